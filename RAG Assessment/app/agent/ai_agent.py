@@ -1,91 +1,311 @@
 """
 Core AI Agent with decision-making and tool calling
 """
-from typing import Dict, List, Optional
-from openai import AzureOpenAI
+from typing import Dict, Iterator, List, Optional, Tuple
+import asyncio
+import json
+import tiktoken
+from openai import AzureOpenAI, AsyncAzureOpenAI
 from app.config import settings
 from app.rag.vector_store import VectorStore
+from app.rag.embeddings import EmbeddingsGenerator
 from app.agent.memory import SessionMemory
 from app.agent.tools import DocumentSearchTool
+from app.rag.similarity import normalize_rows, topk_cosine
+from app.agent.cache import LRUCache, SemanticCache, context_hash
+
+
+# Topics covered by the company documents, used by the local query classifier
+TOPIC_DESCRIPTIONS = [
+    "HR policies: leave, vacation, sick days, benefits, compensation, code of conduct, work hours and attendance",
+    "Product FAQ: CloudSync features, pricing plans, supported platforms, file sync, sharing and troubleshooting",
+    "IT security policies: passwords, authentication, data classification, acceptable use, incident response, VPN",
+    "Employee onboarding: first day checklist, first week activities, key contacts, company culture and values",
+    "CloudSync REST API documentation: authentication, rate limiting, file and folder endpoints, permissions, users"
+]
+
+# General-knowledge reference queries; a query must be clearly closer to a
+# company topic than to these before it is routed to the documents locally
+GENERIC_DESCRIPTIONS = [
+    "What is the capital of France?",
+    "Explain how photosynthesis works",
+    "Write a Python function that reverses a string",
+    "Who wrote Romeo and Juliet?",
+    "What is 15 percent of 200?",
+    "Tell me a joke",
+    "Summarize the causes of World War I",
+    "How do I cook pasta?"
+]
+
+# Prompt templates, filled with str.format_map on the hot path
+CLASSIFY_PROMPT_PREFIX = "Classify for company-doc retrieval (HR, product FAQ, security, onboarding, API docs).\n"
+CLASSIFY_PROMPT = CLASSIFY_PROMPT_PREFIX + """{ctx}
+Query: {query}
+Answer D (needs company documents) or C (general knowledge)."""
+
+# Sent byte-identical as messages[0] on every answer request so the provider
+# can reuse the cached prompt prefix; never interpolate request data into it
+SYSTEM_PROMPT = """You are a helpful AI assistant. Answer questions clearly and concisely.
+If context from documents is provided, use it to answer the question accurately.
+If no context is provided, use your general knowledge.
+Always be professional and helpful."""
+
+RAG_PROMPT = """Context from company documents:
+{context}
+
+Question: {query}
+
+Please answer based on the provided context. If the context doesn't contain relevant information, say so."""
 
 
 class AIAgent:
     """AI Agent with RAG capabilities and tool calling"""
     
-    def __init__(self, vector_store: VectorStore, session_memory: SessionMemory):
+    def __init__(
+        self,
+        vector_store: VectorStore,
+        session_memory: SessionMemory,
+        embeddings_generator: Optional[EmbeddingsGenerator] = None
+    ):
         self.client = AzureOpenAI(
             api_key=settings.azure_openai_api_key,
             api_version=settings.azure_openai_api_version,
             azure_endpoint=settings.azure_openai_endpoint
         )
+        self.aclient = AsyncAzureOpenAI(
+            api_key=settings.azure_openai_api_key,
+            api_version=settings.azure_openai_api_version,
+            azure_endpoint=settings.azure_openai_endpoint
+        )
         self.deployment = settings.azure_openai_deployment_name
         self.vector_store = vector_store
+        self.embeddings_generator = embeddings_generator or vector_store.embeddings_generator
         self.session_memory = session_memory
         self.document_search_tool = DocumentSearchTool(vector_store)
-    
-    def classify_query(self, query: str, conversation_context: str = "") -> Dict:
-        """Determine if query needs RAG or can be answered directly"""
         
-        classification_prompt = f"""You are a query classifier. Determine if the following query requires searching company documents or can be answered with general knowledge.
-
-Company documents contain information about:
-- HR policies (leave, benefits, code of conduct)
-- Product FAQs and features
-- Security policies
-- Employee onboarding
-- Technical API documentation
-
-Query: {query}
-
-{conversation_context}
-
-Respond with ONLY one word: "DOCUMENT" if it needs company documents, or "DIRECT" if it's general knowledge.
-"""
+        # Restrict classification output to the single tokens "D" / "C"
+        self.encoding = self._load_encoding()
+        self.classify_logit_bias = self._build_classify_logit_bias()
+        
+        # Exact-match caches keyed by (query, context hash)
+        self.classification_cache = LRUCache()
+        self.response_cache = LRUCache()
         
+        # Semantic cache keyed by query embedding
+        self.semantic_cache = SemanticCache(dimension=vector_store.dimension)
+        if settings.semantic_cache_enabled:
+            self.semantic_cache.load(self._cache_fingerprint())
+        
+        # Topic and general-knowledge reference embeddings for the local classifier
+        self.topic_embeddings = None
+        self.generic_embeddings = None
+        if settings.local_classifier_enabled:
+            self._build_topic_embeddings()
+    
+    def _load_encoding(self) -> Optional[tiktoken.Encoding]:
+        """Tokenizer for the chat deployment, or None if it cannot be loaded"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.deployment,
-                messages=[{"role": "user", "content": classification_prompt}],
-                temperature=0,
-                max_tokens=10
+            try:
+                return tiktoken.encoding_for_model(self.deployment)
+            except KeyError:
+                # Deployment names need not match model names
+                return tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            # Encoding files could not be loaded (e.g. offline)
+            print(f"Error loading tokenizer: {str(e)}")
+            return None
+    
+    def _build_classify_logit_bias(self) -> Dict[str, int]:
+        """Bias the classifier completion towards the "D" and "C" tokens"""
+        if self.encoding is None:
+            return {}
+        return {str(self.encoding.encode(label)[0]): 100 for label in ("D", "C")}
+    
+    def _build_topic_embeddings(self):
+        """Embed the topic and general-knowledge references as unit-length rows"""
+        try:
+            embeddings = normalize_rows(
+                self.embeddings_generator.generate_embeddings_batch(TOPIC_DESCRIPTIONS + GENERIC_DESCRIPTIONS)
             )
+        except Exception as e:
+            # Classifier falls back to the LLM for every query
+            print(f"Error building topic embeddings: {str(e)}")
+            return
+        self.topic_embeddings = embeddings[:len(TOPIC_DESCRIPTIONS)]
+        self.generic_embeddings = embeddings[len(TOPIC_DESCRIPTIONS):]
+    
+    def _cache_fingerprint(self) -> str:
+        """Identify the model and corpus the cached answers were produced from"""
+        index_size = self.vector_store.index.ntotal if self.vector_store.index else 0
+        return f"{self.deployment}:{index_size}"
+    
+    def save_cache(self):
+        """Persist the semantic cache to disk"""
+        if settings.semantic_cache_enabled:
+            self.semantic_cache.save()
+    
+    def _classify_local(self, query: str, query_embedding: Optional[List[float]]) -> Optional[Dict]:
+        """Classify against topic embeddings; None when confidence is low
+        
+        Also None without a query embedding: embedding already failed for this
+        query, so retrying it here would only delay the LLM fallback.
+        """
+        if self.topic_embeddings is None or query_embedding is None:
+            return None
+        
+        _, topic_scores = topk_cosine(query_embedding, self.topic_embeddings, 1)
+        _, generic_scores = topk_cosine(query_embedding, self.generic_embeddings, 1)
+        margin = float(topic_scores[0]) - float(generic_scores[0])
+        
+        if margin > settings.classifier_document_margin:
+            return {"needs_rag": True, "classification": "DOCUMENT"}
+        if margin < -settings.classifier_direct_margin:
+            return {"needs_rag": False, "classification": "DIRECT"}
+        return None
+    
+    def classify_query(
+        self,
+        query: str,
+        conversation_context: str = "",
+        query_embedding: Optional[List[float]] = None
+    ) -> Dict:
+        """Determine if query needs RAG or can be answered directly"""
+        try:
+            local = self._classify_local(query, query_embedding)
+            if local:
+                return local
             
-            classification = response.choices[0].message.content.strip().upper()
-            
-            needs_rag = "DOCUMENT" in classification
+            # Low confidence (or no local classifier) - ask the LLM
+            key = (query, context_hash(conversation_context))
+            classification = self.classification_cache.get(key)
+            if classification is None:
+                response = self.client.chat.completions.create(
+                    **self._classification_request(query, conversation_context)
+                )
+                classification = self._parse_classification(response)
+                self.classification_cache.put(key, classification)
+            return dict(classification)
+        except Exception as e:
+            # Default to RAG if classification fails
+            print(f"Classification error: {str(e)}")
+            return {"needs_rag": True, "classification": "DOCUMENT"}
+    
+    async def aclassify_query(
+        self,
+        query: str,
+        conversation_context: str = "",
+        query_embedding: Optional[List[float]] = None
+    ) -> Dict:
+        """Async variant of classify_query"""
+        try:
+            local = self._classify_local(query, query_embedding)
+            if local:
+                return local
             
-            return {
-                "needs_rag": needs_rag,
-                "classification": classification
-            }
+            key = (query, context_hash(conversation_context))
+            classification = self.classification_cache.get(key)
+            if classification is None:
+                response = await self.aclient.chat.completions.create(
+                    **self._classification_request(query, conversation_context)
+                )
+                classification = self._parse_classification(response)
+                self.classification_cache.put(key, classification)
+            return dict(classification)
         except Exception as e:
             # Default to RAG if classification fails
             print(f"Classification error: {str(e)}")
             return {"needs_rag": True, "classification": "DOCUMENT"}
     
+    def _classification_request(self, query: str, conversation_context: str) -> Dict:
+        """Build chat completion arguments for LLM classification"""
+        
+        classification_prompt = CLASSIFY_PROMPT.format_map({"query": query, "ctx": conversation_context})
+        
+        request = {
+            "model": self.deployment,
+            "messages": [{"role": "user", "content": classification_prompt}],
+            "temperature": 0,
+            "max_tokens": 1
+        }
+        if self.classify_logit_bias:
+            request["logit_bias"] = self.classify_logit_bias
+        
+        return request
+    
+    def _parse_classification(self, response) -> Dict:
+        """Turn a single-token classification completion into a routing decision"""
+        label = response.choices[0].message.content.strip().upper()[:1]
+        
+        # Anything other than "C" is treated as needing documents
+        needs_rag = label != "C"
+        
+        return {
+            "needs_rag": needs_rag,
+            "classification": "DOCUMENT" if needs_rag else "DIRECT"
+        }
+    
     def generate_response(
         self, 
         query: str, 
         context: str = "", 
-        conversation_history: str = ""
+        conversation_history: str = "",
+        session_id: Optional[str] = None
     ) -> str:
         """Generate response using LLM"""
+        key = (query, context_hash(context + conversation_history))
+        answer = self.response_cache.get(key)
+        if answer is not None:
+            return answer
         
-        system_prompt = """You are a helpful AI assistant. Answer questions clearly and concisely.
-If context from documents is provided, use it to answer the question accurately.
-If no context is provided, use your general knowledge.
-Always be professional and helpful."""
+        try:
+            response = self.client.chat.completions.create(
+                **self._response_request(query, context, conversation_history, session_id)
+            )
+            answer = response.choices[0].message.content.strip()
+        except Exception as e:
+            raise Exception(f"Error generating response: {str(e)}")
+        
+        self.response_cache.put(key, answer)
+        return answer
+    
+    async def agenerate_response(
+        self, 
+        query: str, 
+        context: str = "", 
+        conversation_history: str = "",
+        session_id: Optional[str] = None
+    ) -> str:
+        """Async variant of generate_response"""
+        key = (query, context_hash(context + conversation_history))
+        answer = self.response_cache.get(key)
+        if answer is not None:
+            return answer
+        
+        try:
+            response = await self.aclient.chat.completions.create(
+                **self._response_request(query, context, conversation_history, session_id)
+            )
+            answer = response.choices[0].message.content.strip()
+        except Exception as e:
+            raise Exception(f"Error generating response: {str(e)}")
+        
+        self.response_cache.put(key, answer)
+        return answer
+    
+    def _response_request(
+        self, 
+        query: str, 
+        context: str, 
+        conversation_history: str, 
+        session_id: Optional[str] = None
+    ) -> Dict:
+        """Build chat completion arguments for answer generation"""
         
         user_message = query
         if context:
-            user_message = f"""Context from company documents:
-{context}
-
-Question: {query}
-
-Please answer based on the provided context. If the context doesn't contain relevant information, say so."""
+            user_message = RAG_PROMPT.format_map({"context": context, "query": query})
         
-        messages = [{"role": "system", "content": system_prompt}]
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
         
         # Add conversation history if available
         if conversation_history:
@@ -93,20 +313,38 @@ Please answer based on the provided context. If the context doesn't contain rele
         
         messages.append({"role": "user", "content": user_message})
         
+        request = {
+            "model": self.deployment,
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": 500
+        }
+        if session_id:
+            # Stable per-session user tag keeps requests routed to the same prefix cache
+            request["user"] = context_hash(session_id)[:32]
+        return request
+    
+    def stream_response(
+        self, 
+        query: str, 
+        context: str = "", 
+        conversation_history: str = "",
+        session_id: Optional[str] = None
+    ) -> Iterator[str]:
+        """Generate response using LLM, yielding content deltas as they arrive"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.deployment,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=500
+            stream = self.client.chat.completions.create(
+                **self._response_request(query, context, conversation_history, session_id),
+                stream=True
             )
-            
-            return response.choices[0].message.content.strip()
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
         except Exception as e:
             raise Exception(f"Error generating response: {str(e)}")
     
-    def execute(self, query: str, session_id: Optional[str] = None) -> Dict:
-        """Main agent execution - process query and return response"""
+    def _start_turn(self, query: str, session_id: Optional[str]) -> Tuple[str, str]:
+        """Resolve the session, record the user query and return prior context"""
         
         # Create or get session
         if not session_id:
@@ -120,8 +358,42 @@ Please answer based on the provided context. If the context doesn't contain rele
         # Add user query to memory
         self.session_memory.add_message(session_id, "user", query)
         
+        return session_id, conversation_context
+    
+    def _semantic_lookup(
+        self,
+        conversation_context: str,
+        query_embedding: Optional[List[float]]
+    ) -> Tuple[bool, Optional[Tuple]]:
+        """Check the semantic cache; it only applies to queries without conversation history"""
+        use_semantic_cache = (
+            settings.semantic_cache_enabled
+            and not conversation_context
+            and query_embedding is not None
+        )
+        cached = self.semantic_cache.lookup(query_embedding) if use_semantic_cache else None
+        return use_semantic_cache, cached
+    
+    def execute(self, query: str, session_id: Optional[str] = None) -> Dict:
+        """Main agent execution - process query and return response"""
+        session_id, conversation_context = self._start_turn(query, session_id)
+        
+        # Embed the query once for cache lookup, classification and retrieval
+        query_embedding = None
+        try:
+            query_embedding = self.embeddings_generator.generate_embedding(query)
+        except Exception as e:
+            print(f"Query embedding error: {str(e)}")
+        
+        use_semantic_cache, cached = self._semantic_lookup(conversation_context, query_embedding)
+        
+        if cached:
+            classification, answer, sources = cached
+            self.session_memory.add_message(session_id, "assistant", answer)
+            return self._build_result(answer, sources, session_id, classification, cache_hit=True)
+        
         # Classify query
-        classification = self.classify_query(query, conversation_context)
+        classification = self.classify_query(query, conversation_context, query_embedding)
         
         sources = []
         context = ""
@@ -129,28 +401,154 @@ Please answer based on the provided context. If the context doesn't contain rele
         # Execute based on classification
         if classification["needs_rag"]:
             # Use RAG - search documents
-            context, sources = self.document_search_tool.run(query)
+            context, sources = self.document_search_tool.run(query, query_embedding)
             
             if not sources:
                 # No documents found
                 answer = "I couldn't find relevant information in the company documents. This might be outside my knowledge base."
             else:
                 # Generate response with document context
-                answer = self.generate_response(query, context, conversation_context)
+                answer = self.generate_response(query, context, conversation_context, session_id)
         else:
             # Direct answer using LLM
-            answer = self.generate_response(query, "", conversation_context)
+            answer = self.generate_response(query, "", conversation_context, session_id)
+        
+        if use_semantic_cache:
+            self.semantic_cache.add(query_embedding, classification, answer, sources)
         
         # Add assistant response to memory
         self.session_memory.add_message(session_id, "assistant", answer)
         
+        return self._build_result(answer, sources, session_id, classification)
+    
+    async def aexecute(self, query: str, session_id: Optional[str] = None) -> Dict:
+        """Async agent execution - classification and retrieval run concurrently"""
+        session_id, conversation_context = self._start_turn(query, session_id)
+        
+        # Embed the query once for cache lookup, classification and retrieval
+        query_embedding = None
+        try:
+            query_embedding = await self.embeddings_generator.agenerate_embedding(query)
+        except Exception as e:
+            print(f"Query embedding error: {str(e)}")
+        
+        use_semantic_cache, cached = self._semantic_lookup(conversation_context, query_embedding)
+        
+        if cached:
+            classification, answer, sources = cached
+            self.session_memory.add_message(session_id, "assistant", answer)
+            return self._build_result(answer, sources, session_id, classification, cache_hit=True)
+        
+        # Retrieval is started speculatively and discarded for DIRECT queries
+        cls_task = asyncio.create_task(
+            self.aclassify_query(query, conversation_context, query_embedding)
+        )
+        ret_task = asyncio.create_task(
+            self.document_search_tool.arun(query, query_embedding)
+        )
+        classification, (context, sources) = await asyncio.gather(cls_task, ret_task)
+        
+        if classification["needs_rag"]:
+            if not sources:
+                # No documents found
+                answer = "I couldn't find relevant information in the company documents. This might be outside my knowledge base."
+            else:
+                # Generate response with document context
+                answer = await self.agenerate_response(query, context, conversation_context, session_id)
+        else:
+            # Direct answer using LLM
+            sources = []
+            answer = await self.agenerate_response(query, "", conversation_context, session_id)
+        
+        if use_semantic_cache:
+            self.semantic_cache.add(query_embedding, classification, answer, sources)
+        
+        # Add assistant response to memory
+        self.session_memory.add_message(session_id, "assistant", answer)
+        
+        return self._build_result(answer, sources, session_id, classification)
+    
+    def stream_execute(self, query: str, session_id: Optional[str] = None) -> Iterator[str]:
+        """Agent execution streamed as server-sent events
+        
+        Yields {"token": ...} events while the answer is generated, then a final
+        {"done": true, ...} event carrying session_id, source and metadata.
+        """
+        session_id, conversation_context = self._start_turn(query, session_id)
+        
+        # Embed the query once for cache lookup, classification and retrieval
+        query_embedding = None
+        try:
+            query_embedding = self.embeddings_generator.generate_embedding(query)
+        except Exception as e:
+            print(f"Query embedding error: {str(e)}")
+        
+        use_semantic_cache, cached = self._semantic_lookup(conversation_context, query_embedding)
+        cache_hit = cached is not None
+        
+        if cached:
+            classification, answer, sources = cached
+            yield self._sse({"token": answer})
+        else:
+            # Classify query
+            classification = self.classify_query(query, conversation_context, query_embedding)
+            
+            sources = []
+            context = ""
+            if classification["needs_rag"]:
+                # Use RAG - search documents
+                context, sources = self.document_search_tool.run(query, query_embedding)
+            
+            if classification["needs_rag"] and not sources:
+                # No documents found
+                answer = "I couldn't find relevant information in the company documents. This might be outside my knowledge base."
+                yield self._sse({"token": answer})
+            else:
+                # Accumulate the streamed answer for memory and caches
+                buffer = []
+                try:
+                    for token in self.stream_response(query, context, conversation_context, session_id):
+                        buffer.append(token)
+                        yield self._sse({"token": token})
+                except Exception as e:
+                    yield self._sse({"error": str(e)})
+                    return
+                
+                answer = "".join(buffer).strip()
+                key = (query, context_hash(context + conversation_context))
+                self.response_cache.put(key, answer)
+            
+            if use_semantic_cache:
+                self.semantic_cache.add(query_embedding, classification, answer, sources)
+        
+        # Add assistant response to memory once the stream completes
+        self.session_memory.add_message(session_id, "assistant", answer)
+        
+        result = self._build_result(answer, sources, session_id, classification, cache_hit=cache_hit)
+        del result["answer"]
+        yield self._sse({"done": True, **result})
+    
+    def _sse(self, payload: Dict) -> str:
+        """Format a payload as a server-sent event"""
+        return f"data: {json.dumps(payload)}\n\n"
+    
+    def _build_result(
+        self,
+        answer: str,
+        sources: List[str],
+        session_id: str,
+        classification: Dict,
+        cache_hit: bool = False
+    ) -> Dict:
+        """Assemble the agent response payload"""
         return {
             "answer": answer,
-            "source": sources,
+            "source": list(sources),
             "session_id": session_id,
             "metadata": {
                 "classification": classification["classification"],
                 "used_rag": classification["needs_rag"],
-                "num_sources": len(sources)
+                "num_sources": len(sources),
+                "cache_hit": cache_hit
             }
         }
@@ -0,0 +1,148 @@
+"""
+Exact and semantic response caches for AI agent
+"""
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from collections import OrderedDict
+import hashlib
+import pickle
+import threading
+import numpy as np
+from pathlib import Path
+from app.config import EMBED_DIM, settings
+from app.rag.similarity import normalize_rows, topk_cosine
+
+
+def context_hash(text: str) -> str:
+    """Short stable hash of a prompt context for use in cache keys"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """Exact-match LRU cache usable from both sync and async code paths
+
+    Streaming requests use it from threadpool threads while other requests
+    use it on the event loop, so every access holds the lock.
+    """
+
+    def __init__(self, maxsize: int = None):
+        self.maxsize = maxsize or settings.response_cache_size
+        self.data: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return cached value or None, marking it as recently used"""
+        with self.lock:
+            if key not in self.data:
+                return None
+            self.data.move_to_end(key)
+            return self.data[key]
+
+    def put(self, key: Hashable, value: Any):
+        """Store a value, evicting the least recently used entry if full"""
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+
+class SemanticCache:
+    """Cache agent answers keyed by query embedding (cosine similarity lookup)"""
+
+    def __init__(self, dimension: int = EMBED_DIM, threshold: float = None, max_entries: int = None):
+        self.dimension = dimension
+        self.threshold = threshold if threshold is not None else settings.semantic_cache_threshold
+        self.max_entries = max_entries or settings.response_cache_size
+        # Unit-length query embeddings in rows [0, size); grown by doubling
+        self.matrix = np.empty((64, dimension), dtype=np.float32)
+        self.size = 0
+        self.entries: List[Tuple[Dict, str, List[str]]] = []  # embedding id -> (classification, answer, sources)
+        self.fingerprint = ""
+        self.cache_file = Path(settings.vector_store_path) / "semantic_cache.pkl"
+        # Matrix rows and entries change together, from threadpool and event-loop callers alike
+        self.lock = threading.Lock()
+
+    def lookup(self, embedding) -> Optional[Tuple[Dict, str, List[str]]]:
+        """Return the cached entry for the most similar query above threshold"""
+        with self.lock:
+            if self.size == 0:
+                return None
+
+            ids, scores = topk_cosine(embedding, self.matrix[:self.size], 1)
+            if scores[0] > self.threshold:
+                return self.entries[ids[0]]
+            return None
+
+    def _append_vectors(self, vectors: np.ndarray):
+        """Append unit-length rows, growing the backing matrix as needed"""
+        needed = self.size + len(vectors)
+        if needed > len(self.matrix):
+            capacity = max(needed, 2 * len(self.matrix))
+            matrix = np.empty((capacity, self.dimension), dtype=np.float32)
+            matrix[:self.size] = self.matrix[:self.size]
+            self.matrix = matrix
+        self.matrix[self.size:needed] = vectors
+        self.size = needed
+
+    def add(self, embedding, classification: Dict, answer: str, sources: List[str]):
+        """Store an answer for a query embedding"""
+        vectors = normalize_rows(embedding)
+        entry = (dict(classification), answer, list(sources))
+        with self.lock:
+            if self.size >= self.max_entries:
+                # Evict the oldest half
+                keep = self.max_entries // 2
+                self.matrix[:keep] = self.matrix[self.size - keep:self.size]
+                self.size = keep
+                self.entries = self.entries[-keep:]
+
+            self._append_vectors(vectors)
+            self.entries.append(entry)
+
+    def clear(self):
+        """Drop all cached entries"""
+        with self.lock:
+            self.size = 0
+            self.entries = []
+
+    def load(self, fingerprint: str = ""):
+        """Load cache from disk, discarding it if the fingerprint changed"""
+        self.fingerprint = fingerprint
+        if not self.cache_file.exists():
+            return
+
+        try:
+            with open(self.cache_file, 'rb') as f:
+                data = pickle.load(f)
+        except Exception as e:
+            print(f"Error loading semantic cache: {str(e)}")
+            return
+
+        if data.get("fingerprint") != fingerprint or data.get("dimension") != self.dimension:
+            print("Semantic cache is stale, starting empty")
+            return
+
+        with self.lock:
+            self._append_vectors(np.asarray(data["vectors"], dtype=np.float32).reshape(-1, self.dimension))
+            self.entries = data["entries"]
+        print(f"Loaded semantic cache with {len(self.entries)} entries")
+
+    def save(self):
+        """Persist cache to disk"""
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            data = {
+                "fingerprint": self.fingerprint,
+                "dimension": self.dimension,
+                "vectors": self.matrix[:self.size].copy(),
+                "entries": list(self.entries)
+            }
+        with open(self.cache_file, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def get_stats(self) -> Dict:
+        """Get cache statistics"""
+        return {
+            "entries": len(self.entries),
+            "threshold": self.threshold
+        }
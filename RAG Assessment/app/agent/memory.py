@@ -2,27 +2,65 @@
 Session-based memory management for AI agent
 """
 from typing import Dict, List, Optional
-from datetime import datetime, timedelta
+from collections import deque
+from datetime import datetime
+import heapq
+import time
 import uuid
 
 
+# Messages store a compact role id instead of the role string
+ROLES = ("user", "assistant")
+ROLE_IDS = {role: i for i, role in enumerate(ROLES)}
+
+
 class SessionMemory:
     """Manage conversation sessions and memory"""
     
-    def __init__(self, timeout_minutes: int = 30):
+    def __init__(self, timeout_minutes: int = 30, max_messages: int = 10):
         self.sessions: Dict[str, Dict] = {}
         self.timeout_minutes = timeout_minutes
+        self.max_messages = max_messages
+        # One (expires_at, session_id) entry per session, pushed on create; an
+        # entry whose session was touched since is re-pushed when it is popped
+        self._expiry_heap: List[tuple] = []
+        # Cleared session dicts kept for reuse by create_session
+        self._pool: deque = deque(maxlen=1024)
     
     def create_session(self) -> str:
         """Create a new session and return session ID"""
+        # Expire idle sessions as new ones arrive; only due heap entries are visited
+        self.cleanup_expired_sessions()
+        
         session_id = str(uuid.uuid4())
-        self.sessions[session_id] = {
-            "messages": [],
-            "created_at": datetime.now(),
-            "last_accessed": datetime.now()
-        }
+        
+        if self._pool:
+            # Reuse a pooled session; its containers were cleared on delete
+            session = self._pool.popleft()
+            now = datetime.now()
+            session["created_at"] = now
+            session["last_accessed"] = now
+        else:
+            now = datetime.now()
+            session = {
+                # (role_id, content, timestamp) tuples; oldest dropped automatically
+                "messages": deque(maxlen=self.max_messages * 2),
+                # Rendered lines for the last max_messages messages
+                "context_lines": deque(maxlen=self.max_messages),
+                "context_str": "",
+                "created_at": now,
+                "last_accessed": now
+            }
+        
+        self.sessions[session_id] = session
+        self._touch(session)
+        heapq.heappush(self._expiry_heap, (session["expires_at"], session_id))
         return session_id
     
+    def _touch(self, session: Dict):
+        """Extend the session's expiry"""
+        session["expires_at"] = time.time() + self.timeout_minutes * 60
+    
     def get_session(self, session_id: str) -> Optional[Dict]:
         """Get session by ID"""
         if session_id not in self.sessions:
@@ -37,22 +75,25 @@ class SessionMemory:
         
         # Update last accessed time
         session["last_accessed"] = datetime.now()
+        self._touch(session)
         return session
     
     def _is_expired(self, session: Dict) -> bool:
         """Check if session has expired"""
-        timeout = timedelta(minutes=self.timeout_minutes)
-        return datetime.now() - session["last_accessed"] > timeout
+        return time.time() > session["expires_at"]
     
     def add_message(self, session_id: str, role: str, content: str):
         """Add a message to session history"""
+        if role not in ROLE_IDS:
+            raise ValueError(f"Unsupported message role: {role}")
+        
         session = self.get_session(session_id)
         if session:
-            session["messages"].append({
-                "role": role,
-                "content": content,
-                "timestamp": datetime.now().isoformat()
-            })
+            session["messages"].append((ROLE_IDS[role], content, time.time()))
+            
+            # Keep the rendered context up to date so reads are O(1)
+            session["context_lines"].append(f"{role}: {content}\n")
+            session["context_str"] = "Previous conversation:\n" + "".join(session["context_lines"])
     
     def get_messages(self, session_id: str, limit: Optional[int] = None) -> List[Dict]:
         """Get conversation history for a session"""
@@ -60,13 +101,25 @@ class SessionMemory:
         if not session:
             return []
         
-        messages = session["messages"]
+        messages = list(session["messages"])
         if limit:
-            return messages[-limit:]
-        return messages
+            messages = messages[-limit:]
+        
+        return [
+            {
+                "role": ROLES[role_id],
+                "content": content,
+                "timestamp": datetime.fromtimestamp(ts).isoformat()
+            }
+            for role_id, content, ts in messages
+        ]
     
     def get_conversation_context(self, session_id: str, max_messages: int = 10) -> str:
         """Get formatted conversation context for LLM"""
+        if max_messages == self.max_messages:
+            session = self.get_session(session_id)
+            return session["context_str"] if session else ""
+        
         messages = self.get_messages(session_id, limit=max_messages)
         
         if not messages:
@@ -79,21 +132,37 @@ class SessionMemory:
         return context
     
     def delete_session(self, session_id: str):
-        """Delete a session"""
-        if session_id in self.sessions:
-            del self.sessions[session_id]
+        """Delete a session and return its dict to the pool"""
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            session["messages"].clear()
+            session["context_lines"].clear()
+            session["context_str"] = ""
+            session["created_at"] = None
+            session["last_accessed"] = None
+            self._pool.append(session)
     
     def cleanup_expired_sessions(self):
         """Remove all expired sessions"""
-        expired_sessions = [
-            sid for sid, session in self.sessions.items()
-            if self._is_expired(session)
-        ]
+        now = time.time()
+        expired_count = 0
         
-        for sid in expired_sessions:
-            self.delete_session(sid)
+        # Only due heap entries are visited: O(k log N) for k due
+        while self._expiry_heap and self._expiry_heap[0][0] < now:
+            _, sid = heapq.heappop(self._expiry_heap)
+            session = self.sessions.get(sid)
+            
+            # Entries of deleted sessions are dropped
+            if session is None:
+                continue
+            if session["expires_at"] < now:
+                self.delete_session(sid)
+                expired_count += 1
+            else:
+                # Touched since it was scheduled: reschedule at its new expiry
+                heapq.heappush(self._expiry_heap, (session["expires_at"], sid))
         
-        return len(expired_sessions)
+        return expired_count
     
     def get_stats(self) -> Dict:
         """Get memory statistics"""
@@ -1,8 +1,9 @@
 """
 Tool definitions for AI agent
 """
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from app.rag.vector_store import VectorStore
+from app.rag.search_batcher import SearchBatcher
 
 
 class DocumentSearchTool:
@@ -10,6 +11,7 @@ class DocumentSearchTool:
     
     def __init__(self, vector_store: VectorStore):
         self.vector_store = vector_store
+        self.search_batcher = SearchBatcher(vector_store)
         self.name = "document_search"
         self.description = """
         Search the company's knowledge base for relevant information.
@@ -22,10 +24,21 @@ class DocumentSearchTool:
         Input should be the user's question.
         """
     
-    def run(self, query: str) -> Tuple[str, List[str]]:
-        """Execute document search"""
-        chunks, sources = self.vector_store.get_relevant_chunks(query)
+    def run(self, query: str, query_embedding: Optional[List[float]] = None) -> Tuple[str, List[str]]:
+        """Execute document search, reusing a precomputed query embedding if given"""
+        chunks, sources = self.vector_store.get_relevant_chunks(query, query_embedding=query_embedding)
+        return self._build_context(chunks, sources)
+    
+    async def arun(self, query: str, query_embedding: Optional[List[float]] = None) -> Tuple[str, List[str]]:
+        """Execute document search without blocking the event loop
         
+        Searches from concurrent requests are batched into a single index call.
+        """
+        chunks, sources = await self.search_batcher.get_relevant_chunks(query, query_embedding)
+        return self._build_context(chunks, sources)
+    
+    def _build_context(self, chunks: List[str], sources: List[str]) -> Tuple[str, List[str]]:
+        """Format retrieved chunks as numbered context"""
         if not chunks:
             return "No relevant documents found.", []
         
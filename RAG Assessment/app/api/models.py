@@ -51,6 +51,7 @@ class HealthResponse(BaseModel):
     status: str
     version: str
     vector_store_stats: Optional[Dict] = None
+    embedding_cache_stats: Optional[Dict] = None
 
 
 class DocumentInfo(BaseModel):
@@ -2,10 +2,13 @@
 API routes for RAG AI Agent
 """
 from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pathlib import Path
+from typing import Dict, List, Tuple
+import os
 from app.api.models import (
     QueryRequest, QueryResponse, ResetSessionRequest,
-    HealthResponse, DocumentsResponse, DocumentInfo
+    HealthResponse, DocumentsResponse
 )
 from app.agent.ai_agent import AIAgent
 from app.rag.vector_store import VectorStore
@@ -21,6 +24,9 @@ agent: AIAgent = None
 vector_store: VectorStore = None
 session_memory: SessionMemory = None
 
+# Cached /documents listing, valid while no scanned directory's mtime changes
+_doc_cache = {"dir_mtimes": None, "result": None}
+
 
 def initialize_dependencies(vs: VectorStore, sm: SessionMemory, ag: AIAgent):
     """Initialize global dependencies"""
@@ -30,7 +36,48 @@ def initialize_dependencies(vs: VectorStore, sm: SessionMemory, ag: AIAgent):
     agent = ag
 
 
-@router.post("/ask", response_model=QueryResponse, status_code=status.HTTP_200_OK)
+def _scan_documents(root: str) -> Tuple[List[Dict], Dict[str, int]]:
+    """Recursively list PDF/TXT files and record the mtime of every directory visited"""
+    docs = []
+    dir_mtimes = {}
+    stack = [root]
+    
+    while stack:
+        directory = stack.pop()
+        dir_mtimes[directory] = os.stat(directory).st_mtime_ns
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    suffix = os.path.splitext(entry.name)[1]
+                    if suffix.lower() in ['.pdf', '.txt']:
+                        docs.append({
+                            "name": entry.name,
+                            "path": entry.path,
+                            "type": suffix[1:]  # Remove the dot
+                        })
+    
+    return docs, dir_mtimes
+
+
+def _directories_unchanged(dir_mtimes: Dict[str, int]) -> bool:
+    """Check whether any cached directory was modified since the last scan"""
+    try:
+        return all(os.stat(d).st_mtime_ns == mtime for d, mtime in dir_mtimes.items())
+    except OSError:
+        return False
+
+
+# Agent results already have the QueryResponse shape, so they are serialized
+# directly with orjson; the model is kept only for the OpenAPI schema
+@router.post(
+    "/ask",
+    response_model=None,
+    response_class=ORJSONResponse,
+    responses={200: {"model": QueryResponse}},
+    status_code=status.HTTP_200_OK
+)
 async def ask_question(request: QueryRequest):
     """
     Process a user query and return an AI-generated response.
@@ -48,9 +95,9 @@ async def ask_question(request: QueryRequest):
             )
         
         # Execute agent
-        result = agent.execute(request.query, request.session_id)
+        result = await agent.aexecute(request.query, request.session_id)
         
-        return QueryResponse(**result)
+        return ORJSONResponse(content=result)
     
     except Exception as e:
         raise HTTPException(
@@ -59,6 +106,27 @@ async def ask_question(request: QueryRequest):
         )
 
 
+@router.post("/ask/stream", status_code=status.HTTP_200_OK)
+async def ask_question_stream(request: QueryRequest):
+    """
+    Process a user query and stream the AI-generated response.
+    
+    Returns server-sent events: one {"token": ...} event per generated chunk,
+    followed by a final {"done": true, ...} event with session_id, source and metadata.
+    """
+    # Validate query length
+    if len(request.query) > settings.max_query_length:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Query too long. Maximum length is {settings.max_query_length} characters."
+        )
+    
+    return StreamingResponse(
+        agent.stream_execute(request.query, request.session_id),
+        media_type="text/event-stream"
+    )
+
+
 @router.post("/reset-session", status_code=status.HTTP_200_OK)
 async def reset_session(request: ResetSessionRequest):
     """Reset a conversation session"""
@@ -77,11 +145,13 @@ async def health_check():
     """Health check endpoint"""
     try:
         vs_stats = vector_store.get_stats() if vector_store else None
+        cache_stats = vector_store.embeddings_generator.get_cache_stats() if vector_store else None
         
         return HealthResponse(
             status="healthy",
             version=settings.app_version,
-            vector_store_stats=vs_stats
+            vector_store_stats=vs_stats,
+            embedding_cache_stats=cache_stats
         )
     except Exception as e:
         return HealthResponse(
@@ -91,25 +161,28 @@ async def health_check():
         )
 
 
-@router.get("/documents", response_model=DocumentsResponse, status_code=status.HTTP_200_OK)
+@router.get(
+    "/documents",
+    response_model=None,
+    response_class=ORJSONResponse,
+    responses={200: {"model": DocumentsResponse}},
+    status_code=status.HTTP_200_OK
+)
 async def list_documents():
     """List all documents in the knowledge base"""
     try:
         documents_path = Path("documents")
         
         if not documents_path.exists():
-            return DocumentsResponse(documents=[], total_count=0)
+            return ORJSONResponse(content={"documents": [], "total_count": 0})
         
-        docs = []
-        for file_path in documents_path.glob("**/*"):
-            if file_path.is_file() and file_path.suffix.lower() in ['.pdf', '.txt']:
-                docs.append(DocumentInfo(
-                    name=file_path.name,
-                    path=str(file_path),
-                    type=file_path.suffix[1:]  # Remove the dot
-                ))
+        # Adding or removing a file updates its parent directory's mtime
+        if _doc_cache["result"] is None or not _directories_unchanged(_doc_cache["dir_mtimes"]):
+            docs, dir_mtimes = _scan_documents(str(documents_path))
+            _doc_cache["dir_mtimes"] = dir_mtimes
+            _doc_cache["result"] = {"documents": docs, "total_count": len(docs)}
         
-        return DocumentsResponse(documents=docs, total_count=len(docs))
+        return ORJSONResponse(content=_doc_cache["result"])
     
     except Exception as e:
         raise HTTPException(
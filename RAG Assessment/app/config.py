@@ -2,10 +2,14 @@
 Configuration management for RAG AI Agent
 """
 from pydantic_settings import BaseSettings
-from typing import List, Optional
+from typing import Final, List, Optional
 import os
 
 
+# Width of text-embedding-ada-002 vectors; fixed so array shapes are known up front
+EMBED_DIM: Final[int] = 1536
+
+
 class Settings(BaseSettings):
     """Application settings loaded from environment variables"""
     
@@ -19,6 +23,20 @@ class Settings(BaseSettings):
     # Vector Store Configuration
     vector_store_type: str = "faiss"  # Options: faiss, azure_search
     vector_store_path: str = "./data/vector_store"
+    faiss_index_type: str = "sq8"  # Options: flat, sq8 (8-bit scalar quantized), hnsw, ivfpq; all inner product
+    faiss_ivfpq_threshold: int = 10000  # Rebuild sq8 stores as IVF-PQ beyond this many vectors
+    faiss_nprobe: int = 16
+    faiss_hnsw_m: int = 32
+    faiss_hnsw_ef_construction: int = 40
+    faiss_hnsw_ef_search: int = 16
+    faiss_ivf_nlist: int = 100
+    faiss_pq_m: int = 8
+    faiss_pq_nbits: int = 8
+    faiss_index_factory: str = ""  # FAISS factory string, e.g. "IVF256,SQ8"; overrides faiss_index_type
+    faiss_keep_raw_vectors: bool = False  # Keep uncompressed vectors in raw_vectors.npy for reranking
+    faiss_rerank_candidates: int = 200  # Hits fetched from a compressed index before exact reranking
+    vector_store_read_only: bool = False  # Serve a memory-mapped index; ingest and save are disabled
+    use_gpu: bool = False  # Requires faiss-gpu; the index is copied back to CPU on save
     
     # Azure AI Search (Optional)
     azure_search_endpoint: Optional[str] = None
@@ -39,7 +57,31 @@ class Settings(BaseSettings):
     chunk_size: int = 1000
     chunk_overlap: int = 200
     top_k_results: int = 3
-    similarity_threshold: float = 0.7
+    search_batch_window_ms: float = 5.0  # Concurrent searches within this window share one index call
+    query_embedding_cache_size: int = 2048
+    search_cache_size: int = 1024
+    search_cache_ttl_seconds: int = 60
+    similarity_threshold: float = 0.79  # Cosine; matches the old 0.7 cutoff on 1/(1+L2²) scores
+    embedding_batch_size: int = 96  # Inputs per embeddings request
+    embedding_batch_max_tokens: int = 32000  # Approximate token budget per embeddings request
+    embedding_max_concurrency: int = 8
+    
+    # Azure OpenAI Batch API for bulk ingestion (requires a batch deployment)
+    embedding_batch_api_enabled: bool = False
+    embedding_batch_api_threshold: int = 500
+    embedding_batch_poll_seconds: int = 30
+    
+    # Response Caching
+    semantic_cache_enabled: bool = True
+    semantic_cache_threshold: float = 0.95
+    response_cache_size: int = 4096
+    
+    # Local Query Classifier: compares the best company-topic match with the best
+    # general-knowledge match (ada-002 cosines of unrelated texts are ~0.7, so
+    # absolute thresholds do not separate them); the LLM decides within the margins
+    local_classifier_enabled: bool = True
+    classifier_document_margin: float = 0.05
+    classifier_direct_margin: float = 0.05
     
     class Config:
         env_file = ".env"
@@ -57,13 +57,21 @@ async def lifespan(app: FastAPI):
     # Shutdown
     logger.info("Shutting down application...")
     
-    # Save vector store
-    if vector_store:
+    # Save vector store (read-only stores have nothing to persist)
+    if vector_store and not vector_store.read_only:
         try:
             vector_store.save()
             logger.info("Vector store saved successfully")
         except Exception as e:
             logger.error(f"Error saving vector store: {str(e)}")
+    
+    # Save semantic response cache
+    if agent:
+        try:
+            agent.save_cache()
+            logger.info("Semantic cache saved successfully")
+        except Exception as e:
+            logger.error(f"Error saving semantic cache: {str(e)}")
 
 
 # Create FastAPI app
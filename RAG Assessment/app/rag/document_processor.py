@@ -1,15 +1,41 @@
 """
 Document processing and chunking for RAG
 """
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import diskcache
 import PyPDF2
 import pdfplumber
+import pypdfium2 as pdfium
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from app.config import settings
 
 
+# Below this share of letters among non-space characters, PDFium output is
+# treated as unreliable (scanned or layout-heavy) and the slower parsers are used
+MIN_ALPHA_RATIO = 0.5
+
+# PDF extraction mixes CPU work with disk reads, so a few more workers than
+# cores keeps the CPUs busy without thrashing the disk
+WORKERS_PER_CORE = 2
+
+# One processor per worker process, created on its first task
+_worker_processor = None
+
+
+def _process_one(file_path: str) -> Tuple[str, List[Dict], Optional[str]]:
+    """Process one document in a worker process, returning errors instead of raising"""
+    global _worker_processor
+    if _worker_processor is None:
+        _worker_processor = DocumentProcessor()
+    try:
+        return file_path, _worker_processor.process_document(file_path), None
+    except Exception as e:
+        return file_path, [], str(e)
+
+
 class DocumentProcessor:
     """Process documents for RAG indexing"""
     
@@ -20,9 +46,53 @@ class DocumentProcessor:
             length_function=len,
             separators=["\n\n", "\n", ". ", " ", ""]
         )
+        # Extracted PDF text, opened lazily by the process that uses it
+        self.pdf_cache_path = str(Path(settings.vector_store_path) / "pdf_cache")
+        self._pdf_cache = None
+    
+    @property
+    def pdf_cache(self) -> diskcache.Cache:
+        """Disk cache of extracted PDF text"""
+        if self._pdf_cache is None:
+            self._pdf_cache = diskcache.Cache(self.pdf_cache_path)
+        return self._pdf_cache
     
     def load_pdf(self, file_path: str) -> str:
         """Extract text from PDF file"""
+        # Try PDFium first (C++ backend, much faster than pdfminer)
+        try:
+            text = self._load_pdf_pdfium(file_path)
+            if self._is_usable_text(text):
+                return text
+        except Exception as e:
+            print(f"PDFium extraction failed for {file_path}: {str(e)}")
+        
+        return self._load_pdf_fallback(file_path)
+    
+    def _load_pdf_pdfium(self, file_path: str) -> str:
+        """Extract text with pypdfium2"""
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            pages = []
+            for page in pdf:
+                textpage = page.get_textpage()
+                pages.append(textpage.get_text_range())
+                textpage.close()
+                page.close()
+        finally:
+            pdf.close()
+        
+        return "\n".join(pages).replace("\r\n", "\n").strip()
+    
+    def _is_usable_text(self, text: str) -> bool:
+        """Check extracted text is non-empty and mostly letters"""
+        chars = [c for c in text if not c.isspace()]
+        if not chars:
+            return False
+        return sum(c.isalpha() for c in chars) / len(chars) >= MIN_ALPHA_RATIO
+    
+    def _load_pdf_fallback(self, file_path: str) -> str:
+        """Extract text with pdfplumber, then PyPDF2"""
         text = ""
         try:
             # Try pdfplumber first (better for complex PDFs)
@@ -56,7 +126,14 @@ class DocumentProcessor:
             raise FileNotFoundError(f"Document not found: {file_path}")
         
         if path.suffix.lower() == '.pdf':
-            return self.load_pdf(file_path)
+            # Skip extraction for files unchanged since they were last parsed
+            stat = path.stat()
+            key = f"{path.absolute()}:{stat.st_size}:{stat.st_mtime_ns}"
+            text = self.pdf_cache.get(key)
+            if text is None:
+                text = self.load_pdf(file_path)
+                self.pdf_cache.set(key, text)
+            return text
         elif path.suffix.lower() == '.txt':
             return self.load_text(file_path)
         else:
@@ -107,14 +184,27 @@ class DocumentProcessor:
         if not directory.exists():
             raise FileNotFoundError(f"Directory not found: {directory_path}")
         
-        # Process all PDF and TXT files
-        for file_path in directory.glob("**/*"):
-            if file_path.suffix.lower() in ['.pdf', '.txt']:
-                try:
-                    chunks = self.process_document(str(file_path))
+        # Process all PDF and TXT files in parallel
+        file_paths = [
+            str(file_path) for file_path in directory.glob("**/*")
+            if file_path.suffix.lower() in ['.pdf', '.txt']
+        ]
+        
+        if not file_paths:
+            return all_chunks
+        
+        max_workers = min(len(file_paths), WORKERS_PER_CORE * (os.cpu_count() or 1))
+        # Batch files per task only when there are enough to give every worker
+        # several tasks; small corpora go one file per task so no worker idles
+        chunksize = max(1, len(file_paths) // (4 * max_workers))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for file_path, chunks, error in executor.map(_process_one, file_paths, chunksize=chunksize):
+                name = Path(file_path).name
+                if error:
+                    print(f"Error processing {name}: {error}")
+                else:
                     all_chunks.extend(chunks)
-                    print(f"Processed: {file_path.name} ({len(chunks)} chunks)")
-                except Exception as e:
-                    print(f"Error processing {file_path.name}: {str(e)}")
+                    print(f"Processed: {name} ({len(chunks)} chunks)")
         
         return all_chunks
+
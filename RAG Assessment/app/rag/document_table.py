@@ -0,0 +1,179 @@
+"""
+Memory-mapped Arrow storage for document chunks
+"""
+from typing import Dict, Iterator, List, Optional
+import os
+import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+from pathlib import Path
+
+
+# On-disk layout: one row per chunk, metadata kept as a JSON string so that
+# differing metadata keys across files never force a schema change
+SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("content", pa.string()),
+    ("file_path", pa.string()),
+    ("metadata", pa.string())
+])
+
+
+def file_key(metadata: Dict) -> Optional[str]:
+    """The file a chunk came from: its full path, since names repeat across folders"""
+    return metadata.get("file_path") or metadata.get("source")
+
+
+def _to_columns(documents: List[Dict], ids: List[int]) -> pa.Table:
+    """Convert chunk dicts to a table with the storage schema"""
+    metadata = [doc.get("metadata") or {} for doc in documents]
+    return pa.table({
+        "id": pa.array(ids, pa.int64()),
+        "content": [doc["content"] for doc in documents],
+        "file_path": [file_key(m) for m in metadata],
+        "metadata": [orjson.dumps(m).decode("utf-8") for m in metadata]
+    }, schema=SCHEMA)
+
+
+def _from_row(row: Dict) -> Dict:
+    """Convert a stored row back to a chunk dict (metadata is decoded lazily, per row read)"""
+    return {"content": row["content"], "metadata": orjson.loads(row["metadata"])}
+
+
+class DocumentTable:
+    """List-like view over chunks stored in a memory-mapped Arrow IPC file
+    
+    Persisted rows stay in the mapped table and are converted to dicts only when
+    read; rows added since the last save are kept as plain dicts. Each row has an
+    id matching its FAISS label, so chunks can be fetched and removed by id.
+    """
+    
+    def __init__(self, table: pa.Table = None, documents: List[Dict] = None, ids: List[int] = None):
+        self.table = table
+        self.pending: List[Dict] = list(documents or [])
+        # Stores without explicit ids (older formats) are labelled by position
+        self.pending_ids: List[int] = list(ids) if ids is not None else list(range(len(self.pending)))
+        self.row_of: Optional[Dict[int, int]] = None  # id -> row, built on first lookup
+    
+    @classmethod
+    def open(cls, path: Path) -> "DocumentTable":
+        """Map an Arrow IPC file without reading it into memory"""
+        source = pa.memory_map(str(path), "r")
+        return cls(pa.ipc.open_file(source).read_all())
+    
+    def _table_rows(self) -> int:
+        return self.table.num_rows if self.table is not None else 0
+    
+    def __len__(self) -> int:
+        return self._table_rows() + len(self.pending)
+    
+    def __getitem__(self, i: int) -> Dict:
+        n = self._table_rows()
+        if i < 0:
+            i += len(self)
+        if i < n:
+            return _from_row(self.table.slice(i, 1).to_pylist()[0])
+        return self.pending[i - n]
+    
+    def _rows_by_id(self) -> Dict[int, int]:
+        """Map ids to row positions across persisted and pending rows"""
+        if self.row_of is None:
+            self.row_of = {doc_id: row for row, doc_id in enumerate(self.ids())}
+        return self.row_of
+    
+    def rows_for_ids(self, ids: List[int]) -> List[Optional[int]]:
+        """Row positions of the given ids (None for unknown ids)"""
+        row_of = self._rows_by_id()
+        return [row_of.get(doc_id) for doc_id in ids]
+    
+    def take_ids(self, ids: List[int]) -> List[Optional[Dict]]:
+        """Fetch chunks by id (None for unknown ids), reading persisted rows in one take"""
+        rows = self.rows_for_ids(ids)
+        
+        n = self._table_rows()
+        stored = [row for row in rows if row is not None and row < n]
+        taken = {}
+        if stored:
+            taken = dict(zip(stored, self.table.take(pa.array(stored, pa.int64())).to_pylist()))
+        
+        documents = []
+        for row in rows:
+            if row is None:
+                documents.append(None)
+            elif row < n:
+                documents.append(_from_row(taken[row]))
+            else:
+                documents.append(dict(self.pending[row - n]))
+        return documents
+    
+    def __iter__(self) -> Iterator[Dict]:
+        if self.table is not None:
+            for row in self.table.to_pylist():
+                yield _from_row(row)
+        yield from self.pending
+    
+    def extend(self, documents: List[Dict], ids: List[int] = None):
+        """Append new chunks, labelled by position unless ids are given"""
+        if ids is None:
+            ids = range(len(self), len(self) + len(documents))
+        if self.row_of is not None:
+            for row, doc_id in enumerate(ids, start=len(self)):
+                self.row_of[doc_id] = row
+        self.pending.extend(documents)
+        self.pending_ids.extend(ids)
+    
+    def ids(self) -> List[int]:
+        """Ids of all chunks, in row order"""
+        ids = self.table.column("id").to_pylist() if self.table is not None else []
+        ids.extend(self.pending_ids)
+        return ids
+    
+    def ids_for_files(self, file_paths: List[str]) -> List[int]:
+        """Ids of all chunks from the given files (see file_key)"""
+        ids = []
+        if self.table is not None:
+            mask = pc.is_in(self.table.column("file_path"), value_set=pa.array(file_paths, pa.string()))
+            ids = self.table.column("id").filter(mask).to_pylist()
+        wanted = set(file_paths)
+        ids.extend(
+            doc_id for doc, doc_id in zip(self.pending, self.pending_ids)
+            if file_key(doc.get("metadata") or {}) in wanted
+        )
+        return ids
+    
+    def remove(self, ids: List[int]):
+        """Drop chunks by id; persisted rows are filtered into a new in-memory table"""
+        if not ids:
+            return
+        if self.table is not None:
+            mask = pc.is_in(self.table.column("id"), value_set=pa.array(ids, pa.int64()))
+            self.table = self.table.filter(pc.invert(mask))
+        removed = set(ids)
+        kept = [(doc, doc_id) for doc, doc_id in zip(self.pending, self.pending_ids) if doc_id not in removed]
+        self.pending = [doc for doc, _ in kept]
+        self.pending_ids = [doc_id for _, doc_id in kept]
+        self.row_of = None
+    
+    def to_table(self) -> pa.Table:
+        """Combine persisted and pending rows into one table"""
+        tables = []
+        if self.table is not None:
+            tables.append(self.table)
+        if self.pending or not tables:
+            tables.append(_to_columns(self.pending, self.pending_ids))
+        if len(tables) == 1:
+            return tables[0]
+        return pa.concat_tables(tables)
+    
+    def save(self, path: Path):
+        """Write to an Arrow IPC file, replacing the old file atomically
+        
+        The previous file may still be memory-mapped, so it must never be
+        overwritten in place.
+        """
+        table = self.to_table()
+        tmp_path = Path(str(path) + ".tmp")
+        with pa.OSFile(str(tmp_path), "wb") as sink:
+            with pa.ipc.new_file(sink, SCHEMA) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
@@ -1,12 +1,24 @@
 """
 Embeddings generation using Azure OpenAI
 """
-from typing import List
-from openai import AzureOpenAI
-from app.config import settings
+from typing import Dict, List, Optional
+from openai import AzureOpenAI, AsyncAzureOpenAI, RateLimitError
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from app.config import EMBED_DIM, settings
+import asyncio
+import diskcache
+import hashlib
+import json
+import numpy as np
 import time
 
 
+# Azure OpenAI batch endpoints omit the /v1 prefix used by api.openai.com
+BATCH_EMBEDDINGS_URL = "/embeddings"
+
+
 class EmbeddingsGenerator:
     """Generate embeddings using Azure OpenAI"""
     
@@ -16,14 +28,53 @@ class EmbeddingsGenerator:
             api_version=settings.azure_openai_api_version,
             azure_endpoint=settings.azure_openai_endpoint
         )
+        self.aclient = self._new_async_client()
         self.deployment = settings.azure_openai_embedding_deployment
-        self.cache = {}  # Simple in-memory cache
+        self.dimension = EMBED_DIM
+        
+        # Persistent cache shared across restarts and worker processes
+        self.cache = diskcache.Cache(str(Path(settings.vector_store_path) / "emb_cache"))
+        self.cache.stats(enable=True)
+    
+    def _new_async_client(self) -> AsyncAzureOpenAI:
+        """Create an async client (bound to the event loop it is first used on)"""
+        return AsyncAzureOpenAI(
+            api_key=settings.azure_openai_api_key,
+            api_version=settings.azure_openai_api_version,
+            azure_endpoint=settings.azure_openai_endpoint
+        )
+    
+    def _cache_key(self, text: str) -> bytes:
+        """Cache key: text hash plus deployment, so a model change invalidates entries"""
+        return hashlib.sha256(text.encode("utf-8")).digest() + self.deployment.encode("utf-8")
+    
+    def _cache_get(self, text: str) -> Optional[np.ndarray]:
+        """Return cached embedding as a read-only float32 array, or None"""
+        value = self.cache.get(self._cache_key(text))
+        if value is None:
+            return None
+        return np.frombuffer(value, dtype=np.float32)
+    
+    def _cache_set(self, text: str, embedding):
+        """Store embedding in the cache as packed float32"""
+        self.cache.set(self._cache_key(text), np.asarray(embedding, dtype=np.float32).tobytes())
+    
+    def get_cache_stats(self) -> Dict:
+        """Get embedding cache statistics"""
+        hits, misses = self.cache.stats()
+        return {
+            "entries": len(self.cache),
+            "hits": hits,
+            "misses": misses,
+            "size_bytes": self.cache.volume()
+        }
     
     def generate_embedding(self, text: str) -> List[float]:
         """Generate embedding for a single text"""
         # Check cache
-        if text in self.cache:
-            return self.cache[text]
+        cached = self._cache_get(text)
+        if cached is not None:
+            return cached.tolist()
         
         try:
             response = self.client.embeddings.create(
@@ -33,42 +84,241 @@ class EmbeddingsGenerator:
             embedding = response.data[0].embedding
             
             # Cache the result
-            self.cache[text] = embedding
+            self._cache_set(text, embedding)
             
             return embedding
         except Exception as e:
             raise Exception(f"Error generating embedding: {str(e)}")
     
-    def generate_embeddings_batch(self, texts: List[str], batch_size: int = 16) -> List[List[float]]:
-        """Generate embeddings for multiple texts in batches"""
-        embeddings = []
+    async def agenerate_embedding(self, text: str) -> List[float]:
+        """Async variant of generate_embedding"""
+        cached = self._cache_get(text)
+        if cached is not None:
+            return cached.tolist()
         
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i + batch_size]
+        try:
+            response = await self._acreate_with_retry(self.aclient, text)
+            embedding = response.data[0].embedding
             
-            try:
-                response = self.client.embeddings.create(
-                    input=batch,
-                    model=self.deployment
-                )
-                
-                batch_embeddings = [item.embedding for item in response.data]
-                embeddings.extend(batch_embeddings)
-                
-                # Rate limiting - small delay between batches
-                if i + batch_size < len(texts):
-                    time.sleep(0.1)
-                    
-            except Exception as e:
-                print(f"Error in batch {i}-{i+batch_size}: {str(e)}")
-                # Fallback to individual processing for this batch
-                for text in batch:
-                    try:
-                        emb = self.generate_embedding(text)
-                        embeddings.append(emb)
-                    except Exception as e2:
-                        print(f"Error generating embedding: {str(e2)}")
-                        # Use zero vector as fallback
-                        embeddings.append([0.0] * 1536)
+            # Cache the result
+            self._cache_set(text, embedding)
+            
+            return embedding
+        except Exception as e:
+            raise Exception(f"Error generating embedding: {str(e)}")
+    
+    def generate_embeddings_batch(self, texts: List[str], batch_size: int = None) -> np.ndarray:
+        """Generate embeddings for multiple texts as a (len(texts), dimension) float32 array"""
+        out = np.empty((len(texts), self.dimension), dtype=np.float32)
+        self.fill(texts, out, batch_size)
+        return out
+    
+    def fill(self, texts: List[str], out: np.ndarray, batch_size: int = None):
+        """Write embeddings for texts into the rows of a preallocated array (sync wrapper)"""
+        async def run():
+            # Fresh client per event loop; self.aclient belongs to the serving loop
+            async with self._new_async_client() as client:
+                await self.afill(texts, out, batch_size, client)
+        
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(run())
+            return
+        
+        # Called from inside an event loop - run on a separate thread
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(asyncio.run, run()).result()
+    
+    def generate_embeddings_bulk(self, texts: List[str]) -> np.ndarray:
+        """Generate embeddings for a large corpus through the Batch API
+        
+        Batch jobs cost less and do not count against per-minute token limits,
+        but can take minutes to hours, so this is meant for offline ingestion.
+        Falls back to concurrent requests if the job cannot be completed.
+        """
+        # Serve cache hits and only submit the misses
+        out = np.empty((len(texts), self.dimension), dtype=np.float32)
+        miss_indices = self._fill_cached(texts, out)
+        if not miss_indices:
+            return out
+        
+        # Both paths cache the embeddings the API actually returned
+        miss_texts = [texts[i] for i in miss_indices]
+        try:
+            embeddings = self._run_batch_job(miss_texts)
+        except Exception as e:
+            print(f"Batch embedding job failed, using direct requests: {str(e)}")
+            embeddings = self.generate_embeddings_batch(miss_texts)
+        
+        for i, emb in zip(miss_indices, embeddings):
+            out[i] = emb
+        
+        return out
+    
+    def _run_batch_job(self, texts: List[str]) -> List[List[float]]:
+        """Upload a JSONL embeddings job, wait for it and parse results in input order"""
+        lines = [
+            json.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": BATCH_EMBEDDINGS_URL,
+                "body": {"model": self.deployment, "input": text}
+            })
+            for i, text in enumerate(texts)
+        ]
+        batch_file = self.client.files.create(
+            file=("embeddings.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint=BATCH_EMBEDDINGS_URL,
+            completion_window="24h"
+        )
+        print(f"Submitted batch embedding job {batch.id} for {len(texts)} texts")
+        
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(settings.embedding_batch_poll_seconds)
+            batch = self.client.batches.retrieve(batch.id)
+        
+        if batch.status != "completed" or not batch.output_file_id:
+            raise Exception(f"Batch job {batch.id} ended with status {batch.status}")
+        
+        embeddings = [None] * len(texts)
+        output = self.client.files.content(batch.output_file_id).text
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") == 200:
+                i = int(record["custom_id"])
+                embeddings[i] = response["body"]["data"][0]["embedding"]
+                self._cache_set(texts[i], embeddings[i])
+        
+        # Requests that failed inside the job are retried directly
+        failed = [i for i, emb in enumerate(embeddings) if emb is None]
+        if failed:
+            print(f"Retrying {len(failed)} failed batch requests directly")
+            retried = self.generate_embeddings_batch([texts[i] for i in failed])
+            for i, emb in zip(failed, retried):
+                embeddings[i] = emb
         
         return embeddings
+    
+    async def agenerate_embeddings_batch(
+        self,
+        texts: List[str],
+        batch_size: int = None,
+        client: AsyncAzureOpenAI = None
+    ) -> np.ndarray:
+        """Generate embeddings for multiple texts in concurrent batches"""
+        out = np.empty((len(texts), self.dimension), dtype=np.float32)
+        await self.afill(texts, out, batch_size, client)
+        return out
+    
+    async def afill(
+        self,
+        texts: List[str],
+        out: np.ndarray,
+        batch_size: int = None,
+        client: AsyncAzureOpenAI = None
+    ):
+        """Write embeddings for texts into the rows of out, requesting only cache misses"""
+        miss_indices = self._fill_cached(texts, out)
+        await self._aembed_uncached(
+            [texts[i] for i in miss_indices], miss_indices, out, batch_size, client or self.aclient
+        )
+    
+    def _fill_cached(self, texts: List[str], out: np.ndarray) -> List[int]:
+        """Copy cached embeddings into out and return the indices of the misses"""
+        miss_indices = []
+        for i, text in enumerate(texts):
+            cached = self._cache_get(text)
+            if cached is None:
+                miss_indices.append(i)
+            else:
+                out[i] = cached
+        return miss_indices
+    
+    async def _aembed_uncached(
+        self,
+        texts: List[str],
+        rows: List[int],
+        out: np.ndarray,
+        batch_size: int,
+        client: AsyncAzureOpenAI
+    ):
+        """Request embeddings from the API concurrently, writing texts[i] to out[rows[i]]"""
+        if not texts:
+            return
+        
+        batches = self._pack_batches(texts, batch_size or settings.embedding_batch_size)
+        semaphore = asyncio.Semaphore(settings.embedding_max_concurrency)
+        
+        async def embed_batch(indices: List[int]):
+            batch = [texts[i] for i in indices]
+            async with semaphore:
+                try:
+                    response = await self._acreate_with_retry(client, batch)
+                    embeddings = [item.embedding for item in response.data]
+                except Exception as e:
+                    print(f"Error in batch of {len(batch)}: {str(e)}")
+                    # Fallback to individual processing for this batch
+                    embeddings = [await self._aembed_single(client, text) for text in batch]
+            
+            # Write each batch as it lands, straight into its output rows;
+            # zero-vector fallbacks are never cached
+            for i, emb in zip(indices, embeddings):
+                if emb is None:
+                    out[rows[i]] = 0.0
+                    continue
+                out[rows[i]] = emb
+                self._cache_set(texts[i], out[rows[i]])
+        
+        await asyncio.gather(*[embed_batch(indices) for indices in batches])
+    
+    def _pack_batches(self, texts: List[str], batch_size: int) -> List[List[int]]:
+        """Group text indices into requests bounded by input count and token budget"""
+        # Sorting by length packs texts of similar size into the same request
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        
+        batches = []
+        current = []
+        current_tokens = 0
+        for i in order:
+            tokens = len(texts[i]) // 4 + 1  # ~4 characters per token for English text
+            if current and (
+                len(current) >= batch_size
+                or current_tokens + tokens > settings.embedding_batch_max_tokens
+            ):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        
+        return batches
+    
+    async def _acreate_with_retry(self, client: AsyncAzureOpenAI, batch):
+        """Call the embeddings endpoint, backing off exponentially on HTTP 429"""
+        async for attempt in AsyncRetrying(
+            retry=retry_if_exception_type(RateLimitError),
+            wait=wait_random_exponential(multiplier=1, max=30),
+            stop=stop_after_attempt(6),
+            reraise=True
+        ):
+            with attempt:
+                return await client.embeddings.create(input=batch, model=self.deployment)
+    
+    async def _aembed_single(self, client: AsyncAzureOpenAI, text: str) -> Optional[List[float]]:
+        """Embed one text, returning None on failure (callers use a zero vector)"""
+        try:
+            response = await self._acreate_with_retry(client, text)
+            return response.data[0].embedding
+        except Exception as e:
+            print(f"Error generating embedding: {str(e)}")
+            return None
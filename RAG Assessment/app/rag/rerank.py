@@ -0,0 +1,26 @@
+"""
+Exact rescoring of approximate search candidates against uncompressed vectors
+"""
+import numba
+import numpy as np
+
+
+# Serial like the similarity kernel: a few hundred candidates do not need
+# threads, and searches call this concurrently from worker threads
+@numba.njit(nogil=True, fastmath=True, cache=True)
+def rerank(query, vectors, rows):
+    """Dot product of the query with the given rows of vectors
+
+    Rows are gathered inside the kernel, so candidates are read straight from a
+    memory-mapped matrix without first copying them out.
+    """
+    n = rows.shape[0]
+    d = query.shape[0]
+    scores = np.empty(n, dtype=np.float32)
+    for i in range(n):
+        row = rows[i]
+        s = np.float32(0.0)
+        for j in range(d):
+            s += vectors[row, j] * query[j]
+        scores[i] = s
+    return scores
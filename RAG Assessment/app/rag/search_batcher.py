@@ -0,0 +1,56 @@
+"""
+Micro-batching of concurrent vector store searches
+"""
+from typing import List, Optional, Tuple
+import asyncio
+from app.config import settings
+from app.rag.vector_store import VectorStore
+
+
+class SearchBatcher:
+    """Collect searches arriving within a short window and run them as one batch"""
+    
+    def __init__(self, vector_store: VectorStore, window_ms: float = None):
+        self.vector_store = vector_store
+        if window_ms is None:
+            window_ms = settings.search_batch_window_ms
+        self.window = window_ms / 1000
+        self.pending: List[Tuple[str, Optional[List[float]], asyncio.Future]] = []
+        self.flush_task: Optional[asyncio.Task] = None
+    
+    async def get_relevant_chunks(
+        self,
+        query: str,
+        query_embedding: Optional[List[float]] = None
+    ) -> Tuple[List[str], List[str]]:
+        """Queue a search and wait for the batch it lands in"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((query, query_embedding, future))
+        
+        # The first search in a window schedules the flush
+        if len(self.pending) == 1:
+            self.flush_task = loop.create_task(self._flush_after_window())
+        
+        return await future
+    
+    async def _flush_after_window(self):
+        """Wait for the window to close, then search all queued queries at once"""
+        await asyncio.sleep(self.window)
+        batch, self.pending = self.pending, []
+        
+        queries = [query for query, _, _ in batch]
+        embeddings = [embedding for _, embedding, _ in batch]
+        try:
+            results = await asyncio.to_thread(
+                self.vector_store.get_relevant_chunks_batch, queries, None, embeddings
+            )
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,53 @@
+"""
+JIT-compiled similarity kernels for small in-memory embedding matrices
+"""
+from typing import Tuple
+import numba
+import numpy as np
+
+
+# Eagerly compiled for C-contiguous float32 input only: the unit inner stride
+# lets LLVM vectorize the dot product (EMBED_DIM = 96 AVX-512 vectors of 16 floats).
+# Deliberately serial: the matrices are small, and the kernel is called
+# concurrently from the event loop and worker threads, which Numba's default
+# workqueue threading layer cannot handle for parallel kernels.
+@numba.njit("float32[::1](float32[::1], float32[:, ::1])", nogil=True, fastmath=True, cache=True)
+def _dot_rows(query, matrix):
+    """Dot product of every matrix row with the query vector"""
+    n, d = matrix.shape
+    scores = np.empty(n, dtype=np.float32)
+    for i in range(n):
+        s = np.float32(0.0)
+        for j in range(d):
+            s += matrix[i, j] * query[j]
+        scores[i] = s
+    return scores
+
+
+def normalize_rows(matrix) -> np.ndarray:
+    """Return a C-contiguous float32 copy of matrix with unit-length rows"""
+    matrix = np.array(matrix, dtype=np.float32, order="C", ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.maximum(norms, 1e-12)
+    return matrix
+
+
+def topk_cosine(query, matrix: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k rows of a row-normalized matrix by cosine similarity to query
+    
+    Returns (indices, scores) sorted by descending score.
+    """
+    n = matrix.shape[0]
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    
+    scores = _dot_rows(normalize_rows(query)[0], np.ascontiguousarray(matrix, dtype=np.float32))
+    
+    k = min(k, n)
+    if k < n:
+        indices = np.argpartition(-scores, k - 1)[:k]
+    else:
+        indices = np.arange(n)
+    indices = indices[np.argsort(-scores[indices])]
+    
+    return indices, scores[indices]
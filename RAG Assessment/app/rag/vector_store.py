@@ -1,64 +1,320 @@
 """
 Vector store management for document retrieval
 """
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional
+from functools import lru_cache
+import importlib
 import os
 import pickle
+import threading
 import faiss
 import numpy as np
+import xxhash
+from cachetools import TTLCache
 from pathlib import Path
-from app.config import settings
+from app.config import EMBED_DIM, settings
 from app.rag.embeddings import EmbeddingsGenerator
+from app.rag.document_table import DocumentTable, file_key
+from app.rag.rerank import rerank
+
+
+def document_id(document: Dict) -> int:
+    """Stable int64 FAISS id for a chunk, derived from its source file and position"""
+    metadata = document.get("metadata") or {}
+    chunk_index = metadata.get("chunk_index")
+    if chunk_index is None:
+        chunk_index = document["content"]
+    key = f"{file_key(metadata) or ''}#{chunk_index}"
+    # Keep ids non-negative; FAISS uses -1 for missing results
+    return xxhash.xxh64_intdigest(key.encode("utf-8")) & 0x7FFFFFFFFFFFFFFF
+
+
+def _ivf_index(index: faiss.Index) -> Optional[faiss.IndexIVF]:
+    """The inverted-file index inside index, or None if it is not IVF-based"""
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def _is_torch_tensor(value: Any) -> bool:
+    """Duck-typed torch.Tensor check, so torch stays an optional dependency"""
+    return type(value).__module__.startswith("torch") and hasattr(value, "is_cuda")
 
 
 class VectorStore:
     """FAISS-based vector store for document retrieval"""
     
-    def __init__(self):
+    def __init__(self, read_only: bool = None):
         self.embeddings_generator = EmbeddingsGenerator()
+        # Read-only stores memory-map the index and refuse ingest and save
+        self.read_only = settings.vector_store_read_only if read_only is None else read_only
         self.index = None
-        self.documents = []  # Store document chunks with metadata
-        self.dimension = 1536  # OpenAI embedding dimension
+        self.gpu_resources = None
+        self.on_gpu = False
+        self.documents = DocumentTable()  # Store document chunks with metadata
+        self.raw_vectors: Optional[np.ndarray] = None  # Uncompressed vectors, one row per document
+        self.dimension = EMBED_DIM
         self.store_path = Path(settings.vector_store_path)
         self.store_path.mkdir(parents=True, exist_ok=True)
+        
+        # Repeated queries skip the embedding call and, within the TTL, the index scan
+        self._embed_query = lru_cache(maxsize=settings.query_embedding_cache_size)(self._embed_query_bytes)
+        self.search_cache = TTLCache(maxsize=settings.search_cache_size, ttl=settings.search_cache_ttl_seconds)
+        self.search_cache_lock = threading.Lock()
     
     def initialize(self):
         """Initialize or load existing FAISS index"""
         index_file = self.store_path / "faiss_index.bin"
-        docs_file = self.store_path / "documents.pkl"
+        docs_file = self.store_path / "documents.arrow"
+        legacy_docs_file = self.store_path / "documents.pkl"
         
         if index_file.exists() and docs_file.exists():
-            # Load existing index
-            self.index = faiss.read_index(str(index_file))
-            with open(docs_file, 'rb') as f:
-                self.documents = pickle.load(f)
+            # Load existing index; documents stay memory-mapped
+            self.index = self._read_index(index_file)
+            self.documents = DocumentTable.open(docs_file)
             print(f"Loaded existing index with {len(self.documents)} documents")
+        elif index_file.exists() and legacy_docs_file.exists():
+            # Pickled store from older versions; rewritten as Arrow on next save
+            self.index = self._read_index(index_file)
+            with open(legacy_docs_file, 'rb') as f:
+                self.documents = DocumentTable(documents=pickle.load(f))
+            print(f"Loaded existing index with {len(self.documents)} documents (legacy format)")
         else:
             # Create new index
-            self.index = faiss.IndexFlatL2(self.dimension)
-            self.documents = []
+            self.index = self._create_index()
+            self.documents = DocumentTable()
             print("Created new FAISS index")
+        
+        self._configure_index()
+        self._load_raw_vectors()
+        self._maybe_move_to_gpu()
+    
+    def _read_index(self, index_file: Path) -> faiss.Index:
+        """Read the index, memory-mapping it in read-only mode"""
+        index = None
+        if self.read_only:
+            try:
+                # The OS pages in only the parts of the index that searches touch
+                index = faiss.read_index(str(index_file), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError as e:
+                print(f"Could not memory-map index, loading into memory: {str(e)}")
+        if index is None:
+            index = faiss.read_index(str(index_file))
+        if index.d != self.dimension:
+            raise Exception(f"Index dimension {index.d} does not match embedding dimension {self.dimension}")
+        return index
+    
+    def _create_index(self, index_type: str = None) -> faiss.Index:
+        """Create an empty index of the configured type, addressed by stable document ids"""
+        index = self._create_base_index(index_type)
+        if _ivf_index(index) is not None:
+            # IVF lists store ids natively; an id map on top breaks after remove_ids
+            return index
+        return faiss.IndexIDMap2(index)
+    
+    def _create_base_index(self, index_type: str = None) -> faiss.Index:
+        """Create the underlying vector index of the configured type"""
+        if index_type is None and settings.faiss_index_factory:
+            # e.g. "IVF256,SQ8" or "OPQ32_128,IVF1024,PQ32x8"
+            return faiss.index_factory(
+                self.dimension, settings.faiss_index_factory, faiss.METRIC_INNER_PRODUCT
+            )
+        
+        index_type = index_type or settings.faiss_index_type
+        
+        if index_type == "flat":
+            # Exact search; inner product of unit vectors is the cosine similarity
+            return faiss.IndexFlatIP(self.dimension)
+        
+        if index_type == "hnsw":
+            # Graph index: sub-linear search without training
+            index = faiss.IndexHNSWFlat(
+                self.dimension, settings.faiss_hnsw_m, faiss.METRIC_INNER_PRODUCT
+            )
+            index.hnsw.efConstruction = settings.faiss_hnsw_ef_construction
+            index.hnsw.efSearch = settings.faiss_hnsw_ef_search
+            return index
+        
+        if index_type == "ivfpq":
+            # Inverted lists over product-quantized codes; trained on the first batch
+            quantizer = faiss.IndexFlatIP(self.dimension)
+            index = faiss.IndexIVFPQ(
+                quantizer,
+                self.dimension,
+                settings.faiss_ivf_nlist,
+                settings.faiss_pq_m,
+                settings.faiss_pq_nbits,
+                faiss.METRIC_INNER_PRODUCT
+            )
+            index.nprobe = settings.faiss_nprobe
+            return index
+        
+        # 8-bit scalar quantization: 4x smaller than fp32, cosine via inner product
+        return faiss.IndexScalarQuantizer(
+            self.dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+        )
+    
+    def _has_id_map(self) -> bool:
+        """Whether the index is wrapped in an id map"""
+        return isinstance(self.index, faiss.IndexIDMap)
+    
+    def _supports_ids(self) -> bool:
+        """Stores created before stable ids label flat vectors by insertion position"""
+        return self._has_id_map() or _ivf_index(self.index) is not None
+    
+    def _base_index(self) -> faiss.Index:
+        """The vector index beneath the id map"""
+        if self._has_id_map():
+            return faiss.downcast_index(self.index.index)
+        return self.index
+    
+    def _configure_index(self):
+        """Apply search-time parameters, which are not stored with the index"""
+        ivf = _ivf_index(self.index)
+        base = self._base_index()
+        if ivf is not None:
+            ivf.nprobe = settings.faiss_nprobe
+        elif isinstance(base, faiss.IndexHNSW):
+            base.hnsw.efSearch = settings.faiss_hnsw_ef_search
+    
+    def _load_raw_vectors(self):
+        """Memory-map the uncompressed vectors kept for reranking, if enabled"""
+        self.raw_vectors = None
+        if not settings.faiss_keep_raw_vectors:
+            return
+        
+        raw_file = self.store_path / "raw_vectors.npy"
+        if raw_file.exists():
+            raw_vectors = np.load(raw_file, mmap_mode="r")
+        else:
+            raw_vectors = np.empty((0, self.dimension), dtype=np.float32)
+        
+        # Rows are aligned with documents; a store indexed without them cannot use them
+        if len(raw_vectors) != len(self.documents):
+            print("Raw vectors do not match stored documents, reranking disabled")
+            return
+        self.raw_vectors = raw_vectors
+    
+    def _maybe_move_to_gpu(self):
+        """Copy the index to the first GPU when enabled and available"""
+        self.on_gpu = False
+        if not settings.use_gpu or faiss.get_num_gpus() == 0:
+            return
+        
+        try:
+            if self.gpu_resources is None:
+                self.gpu_resources = faiss.StandardGpuResources()
+            self.index = faiss.index_cpu_to_gpu(self.gpu_resources, 0, self.index)
+            self.on_gpu = True
+            print("Moved FAISS index to GPU")
+        except Exception as e:
+            # Not every index type has a GPU implementation (e.g. HNSW, flat SQ8)
+            print(f"Keeping FAISS index on CPU: {str(e)}")
+    
+    def _cpu_index(self) -> faiss.Index:
+        """Index as a CPU copy; GPU indexes cannot be serialized directly"""
+        if self.on_gpu:
+            return faiss.index_gpu_to_cpu(self.index)
+        return self.index
+    
+    def _train_index(self, vectors: np.ndarray):
+        """Train an empty quantized index, falling back to sq8 on too few vectors"""
+        try:
+            self.index.train(vectors)
+        except RuntimeError as e:
+            print(f"Could not train {settings.faiss_index_factory or settings.faiss_index_type} index on {len(vectors)} vectors, using sq8: {str(e)}")
+            self.index = self._create_index("sq8")
+            self.index.train(vectors)
+            self._maybe_move_to_gpu()
+    
+    def _reranks(self) -> bool:
+        """Whether approximate hits are rescored against the raw vectors
+        
+        Only indexes that store compressed vectors (SQ, PQ) gain from this.
+        """
+        if self.raw_vectors is None or not self._uses_inner_product():
+            return False
+        base = self._base_index()
+        return not isinstance(base, (faiss.IndexFlat, faiss.IndexHNSWFlat))
+    
+    def _uses_inner_product(self) -> bool:
+        """Inner-product indexes store unit-length vectors and return cosine scores"""
+        return self.index.metric_type == faiss.METRIC_INNER_PRODUCT
+    
+    def _maybe_upgrade_index(self):
+        """Rebuild a large scalar-quantized index as IVF-PQ"""
+        n = self.index.ntotal
+        base = self._base_index()
+        if (
+            n <= settings.faiss_ivfpq_threshold
+            or not isinstance(base, faiss.IndexScalarQuantizer)
+        ):
+            return
+        
+        print(f"Rebuilding index as IVF-PQ for {n} vectors...")
+        vectors = base.reconstruct_n(0, n)
+        quantizer = faiss.IndexFlatIP(self.dimension)
+        index = faiss.IndexIVFPQ(
+            quantizer, self.dimension, int(np.sqrt(n)), 64, 8, faiss.METRIC_INNER_PRODUCT
+        )
+        index.train(vectors)
+        index.nprobe = settings.faiss_nprobe
+        if self._has_id_map():
+            # IVF stores the ids itself, so the id map is dropped
+            index.add_with_ids(vectors, faiss.vector_to_array(self.index.id_map))
+        else:
+            index.add(vectors)
+        self.index = index
+        self._maybe_move_to_gpu()
     
-    def add_documents(self, documents: List[Dict], save: bool = True):
-        """Add documents to the vector store"""
+    def add_documents(self, documents: List[Dict], save: bool = True, embeddings: Any = None):
+        """Add documents to the vector store
+        
+        Embeddings are generated unless passed in (one row per document, as a
+        list, NumPy array or torch tensor). CUDA tensors are handed to a GPU
+        index by device pointer, without a round trip through host memory.
+        """
         if not documents:
             return
         
-        # Extract text content
-        texts = [doc["content"] for doc in documents]
+        if self.read_only:
+            raise Exception("Cannot add documents: vector store is read-only")
         
-        # Generate embeddings
-        print(f"Generating embeddings for {len(texts)} documents...")
-        embeddings = self.embeddings_generator.generate_embeddings_batch(texts)
+        if embeddings is None:
+            embeddings_array = self._prepare_vectors(self._embed_documents(documents), copy=False)
+        else:
+            embeddings_array = self._prepare_vectors(embeddings)
+        
+        # Quantized indexes are trained on the first batch
+        if not self.index.is_trained:
+            self._train_index(embeddings_array)
         
-        # Convert to numpy array
-        embeddings_array = np.array(embeddings, dtype=np.float32)
+        if self._supports_ids():
+            # Re-ingesting a file replaces its chunks instead of duplicating them
+            self._remove_files({file_key(doc.get("metadata") or {}) for doc in documents})
+            
+            # Add to FAISS index under stable ids
+            ids = np.array([document_id(doc) for doc in documents], dtype=np.int64)
+            if _is_torch_tensor(embeddings_array):
+                # new_tensor would round the 63-bit ids through the embeddings' float32 dtype
+                torch = importlib.import_module("torch")
+                self.index.add_with_ids(embeddings_array, torch.as_tensor(ids, device=embeddings_array.device))
+            else:
+                self.index.add_with_ids(embeddings_array, ids)
+            self.documents.extend(documents, ids.tolist())
+        else:
+            # Positional stores from older versions
+            self.index.add(embeddings_array)
+            self.documents.extend(documents)
+        self._maybe_upgrade_index()
         
-        # Add to FAISS index
-        self.index.add(embeddings_array)
+        if self.raw_vectors is not None:
+            if _is_torch_tensor(embeddings_array):
+                embeddings_array = embeddings_array.cpu().numpy()
+            self.raw_vectors = np.concatenate([self.raw_vectors, embeddings_array])
         
-        # Store documents with metadata
-        self.documents.extend(documents)
+        self.clear_search_cache()
         
         print(f"Added {len(documents)} documents to vector store")
         
@@ -66,62 +322,354 @@ class VectorStore:
         if save:
             self.save()
     
+    def _remove_files(self, file_paths):
+        """Drop all chunks of the given files from the index and documents"""
+        ids = self.documents.ids_for_files([path for path in file_paths if path is not None])
+        if not ids:
+            return
+        
+        self._remove_ids(ids)
+        if self.raw_vectors is not None:
+            rows = self.documents.rows_for_ids(ids)
+            self.raw_vectors = np.delete(self.raw_vectors, [row for row in rows if row is not None], axis=0)
+        self.documents.remove(ids)
+        print(f"Removed {len(ids)} previously indexed chunks")
+    
+    def _remove_ids(self, ids: List[int]):
+        """Delete vectors by id, rebuilding the index when it cannot delete in place
+        
+        Re-ingested chunks get their old ids back, so vectors left behind would
+        resolve to the new chunks.
+        """
+        # Not every GPU index supports removal; work on a CPU copy and move it back
+        on_gpu = self.on_gpu
+        index = self._cpu_index()
+        try:
+            index.remove_ids(np.array(ids, dtype=np.int64))
+        except RuntimeError as e:
+            # e.g. HNSW graphs cannot delete vectors
+            print(f"Index does not support removal, rebuilding it: {str(e)}")
+            self._rebuild_without(index, ids)
+        
+        self.index = index
+        self._configure_index()
+        if on_gpu:
+            self._maybe_move_to_gpu()
+    
+    def _rebuild_without(self, index: faiss.Index, ids: List[int]):
+        """Re-add every vector except the given ids to an emptied index"""
+        removed = set(ids)
+        keep = [(row, doc_id) for row, doc_id in enumerate(self.documents.ids()) if doc_id not in removed]
+        keep_ids = np.array([doc_id for _, doc_id in keep], dtype=np.int64)
+        
+        if self.raw_vectors is not None:
+            vectors = np.asarray(self.raw_vectors)[[row for row, _ in keep]]
+        else:
+            vectors = np.empty((len(keep_ids), self.dimension), dtype=np.float32)
+            for i, doc_id in enumerate(keep_ids.tolist()):
+                vectors[i] = index.reconstruct(doc_id)
+        
+        # Trained quantizers and parameters survive reset
+        index.reset()
+        if len(keep_ids):
+            index.add_with_ids(vectors, keep_ids)
+    
+    def _embed_documents(self, documents: List[Dict]) -> np.ndarray:
+        """Embed document contents, one row per document"""
+        # Extract text content
+        texts = [doc["content"] for doc in documents]
+        
+        # Embed each distinct chunk once; repeated boilerplate reuses the result
+        seen: Dict[int, int] = {}
+        unique_texts = []
+        positions = []
+        for text in texts:
+            key = xxhash.xxh64_intdigest(text.encode("utf-8"))
+            if key not in seen:
+                seen[key] = len(unique_texts)
+                unique_texts.append(text)
+            positions.append(seen[key])
+        
+        # Generate embeddings straight into a preallocated float32 matrix
+        print(f"Generating embeddings for {len(unique_texts)} unique chunks of {len(texts)} documents...")
+        if (
+            settings.embedding_batch_api_enabled
+            and len(unique_texts) > settings.embedding_batch_api_threshold
+        ):
+            embeddings = self.embeddings_generator.generate_embeddings_bulk(unique_texts)
+        else:
+            embeddings = np.empty((len(unique_texts), self.dimension), dtype=np.float32)
+            self.embeddings_generator.fill(unique_texts, embeddings)
+        
+        if len(unique_texts) == len(texts):
+            return embeddings
+        # Scatter back to one row per document
+        return embeddings[positions]
+    
+    def _prepare_vectors(self, vectors: Any, copy: bool = True) -> Any:
+        """Shape embeddings as a (n, d) float32 matrix, unit-length for inner product
+        
+        CUDA tensors stay on device when the index itself is a GPU index;
+        anything else (including an id map wrapping a GPU index) becomes a
+        NumPy array. Arrays owned by the store can skip the defensive copy and
+        are normalized in place.
+        """
+        if _is_torch_tensor(vectors):
+            # An IndexIDMap2 around a GPU index is a CPU object and rejects CUDA tensors
+            if self.on_gpu and vectors.is_cuda and hasattr(self.index, "getDevice"):
+                # Lets FAISS index methods take torch tensors directly
+                importlib.import_module("faiss.contrib.torch_utils")
+                
+                vectors = vectors.detach().float().reshape(-1, self.dimension)
+                if self._uses_inner_product():
+                    vectors = vectors / vectors.norm(dim=1, keepdim=True).clamp_min(1e-12)
+                return vectors.contiguous()
+            vectors = vectors.detach().cpu().numpy()
+        
+        if copy:
+            vectors = np.array(vectors, dtype=np.float32)
+        else:
+            vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        vectors = vectors.reshape(-1, self.dimension)
+        if self._uses_inner_product():
+            faiss.normalize_L2(vectors)
+        return vectors
+    
     def save(self):
         """Save FAISS index and documents to disk"""
+        if self.read_only:
+            raise Exception("Cannot save: vector store is read-only")
+        
         index_file = self.store_path / "faiss_index.bin"
-        docs_file = self.store_path / "documents.pkl"
+        docs_file = self.store_path / "documents.arrow"
         
-        faiss.write_index(self.index, str(index_file))
-        with open(docs_file, 'wb') as f:
-            pickle.dump(self.documents, f)
+        # Write to a temp file and rename, so a crash never leaves a torn index
+        tmp_index_file = self.store_path / "faiss_index.bin.tmp"
+        faiss.write_index(self._cpu_index(), str(tmp_index_file))
+        os.replace(tmp_index_file, index_file)
+        self.documents.save(docs_file)
+        if self.raw_vectors is not None:
+            self._save_raw_vectors()
+        self.clear_search_cache()
         
         print(f"Saved vector store to {self.store_path}")
     
-    def search(self, query: str, top_k: int = None) -> List[Dict]:
-        """Search for relevant documents"""
+    def _save_raw_vectors(self):
+        """Write raw vectors next to the index, replacing the mapped file atomically"""
+        raw_file = self.store_path / "raw_vectors.npy"
+        tmp_file = self.store_path / "raw_vectors.npy.tmp"
+        with open(tmp_file, "wb") as f:
+            np.save(f, np.ascontiguousarray(self.raw_vectors, dtype=np.float32))
+        os.replace(tmp_file, raw_file)
+        self.raw_vectors = np.load(raw_file, mmap_mode="r")
+    
+    def _is_empty(self) -> bool:
+        """True when there is nothing to search (checked before any embedding call)"""
+        return self.index is None or self.index.ntotal == 0
+    
+    def _embed_query_bytes(self, query: str) -> bytes:
+        """Query embedding as packed float32 (immutable, so safe to memoize)"""
+        return np.asarray(self.embeddings_generator.generate_embedding(query), dtype=np.float32).tobytes()
+    
+    def _get_cached_results(self, query: str, top_k: int) -> Optional[List[Dict]]:
+        with self.search_cache_lock:
+            results = self.search_cache.get((query, top_k))
+        return list(results) if results is not None else None
+    
+    def _cache_results(self, query: str, top_k: int, results: List[Dict]):
+        with self.search_cache_lock:
+            self.search_cache[(query, top_k)] = results
+    
+    def clear_search_cache(self):
+        """Forget cached search results (the stored chunks changed)"""
+        with self.search_cache_lock:
+            self.search_cache.clear()
+    
+    def search(
+        self,
+        query: str,
+        top_k: int = None,
+        query_embedding: Any = None
+    ) -> List[Dict]:
+        """Search for relevant documents
+        
+        Returns hits as {"id", "similarity_score", "rank"}; use hydrate() to
+        fetch their content. A precomputed query embedding may be a list, NumPy
+        array or torch tensor. Results are cached briefly by (query, top_k).
+        """
         if top_k is None:
             top_k = settings.top_k_results
         
-        if not self.documents:
+        if self._is_empty():
             return []
         
-        # Generate query embedding
-        query_embedding = self.embeddings_generator.generate_embedding(query)
-        query_vector = np.array([query_embedding], dtype=np.float32)
-        
-        # Search FAISS index
-        distances, indices = self.index.search(query_vector, top_k)
+        cached = self._get_cached_results(query, top_k)
+        if cached is not None:
+            return cached
         
-        # Retrieve documents with scores
-        results = []
-        for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-            if idx < len(self.documents):
-                # Convert L2 distance to similarity score (inverse)
-                similarity = 1 / (1 + distance)
-                
-                # Only include results above threshold
-                if similarity >= settings.similarity_threshold:
-                    result = {
-                        **self.documents[idx],
-                        "similarity_score": float(similarity),
-                        "rank": i + 1
-                    }
-                    results.append(result)
+        # Generate query embedding unless the caller already has one
+        if query_embedding is None:
+            query_embedding = np.frombuffer(self._embed_query(query), dtype=np.float32)
+        query_vectors = self._prepare_vectors(query_embedding)
         
+        results = self._search_vectors(query_vectors, top_k)[0]
+        self._cache_results(query, top_k, results)
         return results
     
-    def get_relevant_chunks(self, query: str, top_k: int = None) -> tuple[List[str], List[str]]:
+    def search_batch(
+        self,
+        queries: List[str],
+        top_k: int = None,
+        query_embeddings: Optional[List[Optional[List[float]]]] = None
+    ) -> List[List[Dict]]:
+        """Search for several queries with a single index call"""
+        if top_k is None:
+            top_k = settings.top_k_results
+        
+        if self._is_empty() or not queries:
+            return [[] for _ in queries]
+        
+        if query_embeddings is None:
+            query_embeddings = [None] * len(queries)
+        
+        # Only queries without cached results go to the index
+        batch_results = [self._get_cached_results(query, top_k) for query in queries]
+        pending = [i for i, results in enumerate(batch_results) if results is None]
+        if not pending:
+            return batch_results
+        
+        # Embed only the queries that arrive without an embedding
+        pending_embeddings = [query_embeddings[i] for i in pending]
+        missing = [j for j, emb in enumerate(pending_embeddings) if emb is None]
+        if missing:
+            generated = self.embeddings_generator.generate_embeddings_batch(
+                [queries[pending[j]] for j in missing]
+            )
+            for j, emb in zip(missing, generated):
+                pending_embeddings[j] = emb
+        query_vectors = self._prepare_vectors(pending_embeddings)
+        
+        for i, results in zip(pending, self._search_vectors(query_vectors, top_k)):
+            batch_results[i] = results
+            self._cache_results(queries[i], top_k, results)
+        
+        return batch_results
+    
+    def _search_vectors(self, query_vectors: Any, top_k: int) -> List[List[Dict]]:
+        """Search FAISS with a prepared (B, d) query matrix, one result list per row"""
+        reranks = self._reranks()
+        
+        # Search FAISS index, over-fetching candidates when they will be reranked
+        k = max(top_k, settings.faiss_rerank_candidates) if reranks else top_k
+        scores, ids = self.index.search(query_vectors, k)
+        if _is_torch_tensor(scores):
+            scores, ids = scores.cpu().numpy(), ids.cpu().numpy()
+        
+        if reranks:
+            scores, ids = self._rerank(query_vectors, ids, top_k)
+        
+        if self._uses_inner_product():
+            # Scores of unit vectors are already cosine similarities
+            similarities = scores
+        else:
+            # Legacy L2 stores hold ada-002 embeddings, which are unit-length, so
+            # squared distances map to cosine and one threshold fits both index kinds
+            similarities = 1 - scores / 2
+        
+        # Only include results above threshold; FAISS pads missing hits with -1
+        keep = (ids >= 0) & (similarities >= settings.similarity_threshold)
+        ranks = np.arange(1, ids.shape[1] + 1)
+        
+        # Lightweight hits; chunk contents are fetched by hydrate()
+        batch_results = []
+        for row_keep, row_similarities, row_ids in zip(keep, similarities, ids):
+            batch_results.append([
+                {"id": doc_id, "similarity_score": similarity, "rank": rank}
+                for doc_id, similarity, rank in zip(
+                    row_ids[row_keep].tolist(),
+                    row_similarities[row_keep].tolist(),
+                    ranks[row_keep].tolist()
+                )
+            ])
+        
+        return batch_results
+    
+    def _rerank(self, query_vectors: Any, ids: np.ndarray, top_k: int):
+        """Rescore candidate ids exactly with the raw vectors, keeping the best top_k per query"""
+        if _is_torch_tensor(query_vectors):
+            query_vectors = query_vectors.cpu().numpy()
+        query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
+        vectors = np.asarray(self.raw_vectors)
+        
+        # Padded with -1 like FAISS when fewer than top_k candidates remain
+        scores = np.full((len(ids), top_k), -np.inf, dtype=np.float32)
+        reranked_ids = np.full((len(ids), top_k), -1, dtype=np.int64)
+        for i, (query, row_ids) in enumerate(zip(query_vectors, ids)):
+            candidates = row_ids[row_ids >= 0]
+            rows = self.documents.rows_for_ids(candidates.tolist())
+            known = np.array([row is not None for row in rows], dtype=bool)
+            if not known.any():
+                continue
+            candidates = candidates[known]
+            rows = np.array([row for row in rows if row is not None], dtype=np.int64)
+            
+            candidate_scores = rerank(query, vectors, rows)
+            order = np.argsort(-candidate_scores)[:top_k]
+            scores[i, :len(order)] = candidate_scores[order]
+            reranked_ids[i, :len(order)] = candidates[order]
+        
+        return scores, reranked_ids
+    
+    def hydrate(self, results: List[Dict]) -> List[Dict]:
+        """Attach chunk content and metadata to search hits
+        
+        Hits whose chunk is no longer stored (stale vectors) are dropped.
+        """
+        documents = self.documents.take_ids([result["id"] for result in results])
+        hydrated = []
+        for document, result in zip(documents, results):
+            if document is None:
+                continue
+            document["similarity_score"] = result["similarity_score"]
+            document["rank"] = result["rank"]
+            hydrated.append(document)
+        return hydrated
+    
+    def get_relevant_chunks(
+        self,
+        query: str,
+        top_k: int = None,
+        query_embedding: Optional[List[float]] = None
+    ) -> tuple[List[str], List[str]]:
         """Get relevant document chunks and their sources"""
-        results = self.search(query, top_k)
+        if self._is_empty():
+            return [], []
+        results = self.search(query, top_k, query_embedding)
+        return self._chunks_and_sources(results)
+    
+    def get_relevant_chunks_batch(
+        self,
+        queries: List[str],
+        top_k: int = None,
+        query_embeddings: Optional[List[Optional[List[float]]]] = None
+    ) -> List[tuple[List[str], List[str]]]:
+        """Get relevant chunks and sources for several queries at once"""
+        batch_results = self.search_batch(queries, top_k, query_embeddings)
+        return [self._chunks_and_sources(results) for results in batch_results]
+    
+    def _chunks_and_sources(self, results: List[Dict]) -> tuple[List[str], List[str]]:
+        """Hydrate search hits once and split them into chunk texts and unique sources"""
+        # Each chunk is fetched once even if it was hit more than once
+        unique_results = {}
+        for result in results:
+            unique_results.setdefault(result["id"], result)
+        documents = self.hydrate(list(unique_results.values()))
         
-        chunks = [result["content"] for result in results]
-        sources = [result["metadata"]["source"] for result in results]
+        chunks = [document["content"] for document in documents]
+        sources = [document["metadata"]["source"] for document in documents]
         
         # Deduplicate sources while preserving order
-        unique_sources = []
-        for source in sources:
-            if source not in unique_sources:
-                unique_sources.append(source)
+        unique_sources = list(dict.fromkeys(sources))
         
         return chunks, unique_sources
     
@@ -131,5 +679,6 @@ class VectorStore:
             "total_documents": len(self.documents),
             "index_size": self.index.ntotal if self.index else 0,
             "dimension": self.dimension,
-            "store_path": str(self.store_path)
+            "store_path": str(self.store_path),
+            "read_only": self.read_only
         }
@@ -70,7 +70,7 @@ def index_documents():
     
     # Initialize document processor and vector store
     processor = DocumentProcessor()
-    vector_store = VectorStore()
+    vector_store = VectorStore(read_only=False)
     vector_store.initialize()
     
     # Process all documents
@@ -83,8 +83,9 @@ def index_documents():
         
         print(f"\n✓ Processed {len(chunks)} document chunks")
         
-        # Add to vector store
-        vector_store.add_documents(chunks, save=True)
+        # Add to vector store, then persist once
+        vector_store.add_documents(chunks, save=False)
+        vector_store.save()
         
         print(f"✓ Indexed documents successfully")
         print(f"✓ Vector store saved to {settings.vector_store_path}")
@@ -103,7 +104,7 @@ def verify_setup():
     # Check vector store exists
     vector_store_path = Path(settings.vector_store_path)
     index_file = vector_store_path / "faiss_index.bin"
-    docs_file = vector_store_path / "documents.pkl"
+    docs_file = vector_store_path / "documents.arrow"
     
     if not index_file.exists() or not docs_file.exists():
         print("❌ Vector store not found")